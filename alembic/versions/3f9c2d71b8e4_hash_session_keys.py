@@ -0,0 +1,47 @@
+"""Store hashed session keys
+
+Revision ID: 3f9c2d71b8e4
+Revises: aaa60591f97f
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9c2d71b8e4'
+down_revision: Union[str, None] = 'aaa60591f97f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+
+    # Existing rows hold raw keys, which can't be matched against hashed
+    # tokens, so every user has to log in again.
+    op.execute("DELETE FROM sessions")
+
+    op.alter_column(
+        'sessions',
+        'session_key',
+        existing_type=sa.String(length=32),
+        type_=sa.String(length=64),
+        existing_nullable=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DELETE FROM sessions")
+
+    op.alter_column(
+        'sessions',
+        'session_key',
+        existing_type=sa.String(length=64),
+        type_=sa.String(length=32),
+        existing_nullable=False,
+    )
@@ -0,0 +1,45 @@
+"""Add revocations table
+
+Revision ID: 8b1e4c0f6a27
+Revises: 3f9c2d71b8e4
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from shavon.utilities import dthelpers
+
+# revision identifiers, used by Alembic.
+revision: str = '8b1e4c0f6a27'
+down_revision: Union[str, None] = '3f9c2d71b8e4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+
+    op.create_table('revocations',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('session_key', sa.String(length=64), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('revoked_at', dthelpers.TZDateTime(), nullable=False),
+        sa.Column('expires_at', dthelpers.TZDateTime(), nullable=False),
+
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(
+        'idx_revocations_revoked_at',
+        'revocations',
+        ['revoked_at'],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('idx_revocations_revoked_at', table_name='revocations')
+    op.drop_table('revocations')
@@ -0,0 +1,52 @@
+"""Add indexes for session lookups and the stale row reaper
+
+Revision ID: c52d9e8a1f30
+Revises: 8b1e4c0f6a27
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c52d9e8a1f30'
+down_revision: Union[str, None] = '8b1e4c0f6a27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = [
+    ('idx_sessions_user_id', 'sessions', ['user_id']),
+    ('idx_sessions_last_accessed', 'sessions', ['last_accessed']),
+    ('idx_login_attempts_last_attempt', 'login_attempts', ['last_attempt']),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+
+    # Build the indexes without blocking writes on Postgres, which can't be
+    # done inside a transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(
+                name,
+                table,
+                columns,
+                unique=False,
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(
+                name,
+                table_name=table,
+                postgresql_concurrently=True,
+                if_exists=True,
+            )
@@ -0,0 +1,47 @@
+"""Add users.version and users.updated_at
+
+Revision ID: e7a4b2c9d013
+Revises: c52d9e8a1f30
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from shavon.utilities import dthelpers
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7a4b2c9d013'
+down_revision: Union[str, None] = 'c52d9e8a1f30'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+
+    # A constant default doesn't rewrite the table on Postgres
+    op.add_column('users', sa.Column(
+        'version', sa.Integer(), nullable=False, server_default=sa.text('1'),
+    ))
+
+    # Existing users were last changed, as far as we know, when created
+    op.add_column('users', sa.Column(
+        'updated_at', dthelpers.TZDateTime(), nullable=True,
+    ))
+    op.execute('UPDATE users SET updated_at = date_created')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.alter_column(
+            'updated_at',
+            existing_type=dthelpers.TZDateTime(),
+            nullable=False,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('updated_at')
+        batch_op.drop_column('version')
@@ -1,11 +1,139 @@
+""" Shavon's per-process shared objects: `db`, the caches, the hashing pool and
+so on, imported as `from shavon import db`.
 
-from shavon import settings
-from shavon.utilities import dbhelpers
+Each is built on first access rather than when the package is imported, so
+tools that only need part of the package, such as Alembic, don't pay for the
+rest, and nothing is created in a process that never uses it.
+"""
 
-# Setup database
-db = dbhelpers.AsyncDatabaseConnection(
-    driver=settings.DB_CONNECT_URL,
-    pool_size=settings.DB_POOL_SIZE,
-    max_overflow=settings.DB_MAX_OVERFLOW,
-    echo=settings.SQL_ECHO
-)
+
+def _db():
+    from shavon import settings
+    from shavon.utilities import dbhelpers
+
+    # Engines and pools are only built when first used, see connect()
+    return dbhelpers.AsyncDatabaseConnection(
+        driver=settings.DB_CONNECT_URL,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        echo=settings.SQL_ECHO,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        statement_cache_size=settings.DB_STATEMENT_CACHE_SIZE,
+        command_timeout=settings.DB_COMMAND_TIMEOUT,
+        statement_timeout=settings.DB_STATEMENT_TIMEOUT,
+        replicas=settings.DB_REPLICA_URLS,
+        replica_eject_seconds=settings.DB_REPLICA_EJECT_SECONDS,
+    )
+
+
+def _hash_executor():
+    from shavon import settings
+    from shavon.utilities import executors
+
+    # Bounded pool for password hashing and verification
+    return executors.BoundedExecutor(
+        max_workers=settings.PASSWORD_HASH_WORKERS,
+        max_queue=settings.PASSWORD_HASH_QUEUE,
+        name="shavon-hash",
+    )
+
+
+def _password_hasher():
+    from shavon import settings
+    from shavon.utilities import passwords
+
+    # Target scheme for new password hashes
+    return passwords.get_hasher(
+        settings.PASSWORD_HASH_SCHEME,
+        settings.PASSWORD_HASH_PARAMS,
+    )
+
+
+def _auth_cache():
+    from shavon import settings
+    from shavon.utilities import cache
+
+    # Validated (Session, User) pairs keyed by (user_id, session_key)
+    return cache.TTLCache(
+        maxsize=settings.AUTH_CACHE_SIZE,
+        ttl=settings.AUTH_CACHE_TTL,
+        name="auth",
+    )
+
+
+def _lookups():
+    from shavon.utilities import singleflight
+
+    # Model lookups in flight, shared by concurrent identical callers
+    return singleflight.SingleFlight(name="lookups")
+
+
+def _page_cache():
+    from shavon import settings
+    from shavon.utilities import cache
+
+    # Rendered anonymous pages keyed by route, path, query string and vary
+    # inputs
+    return cache.TTLCache(
+        maxsize=settings.PAGE_CACHE_SIZE,
+        ttl=settings.PAGE_CACHE_TTL,
+        name="pages",
+    )
+
+
+def _token_codec():
+    from shavon import settings
+    from shavon.utilities import cache
+    from shavon.utilities import tokens
+
+    # Signs and verifies auth cookies. A stateless token's `exp` only ends
+    # the time it is accepted without a lookup, so it isn't enforced here;
+    # auth_required refuses tokens issued over AUTH_COOKIE_LIFESPAN ago
+    return tokens.TokenCodec(
+        algorithm=settings.AUTH_COOKIE_ALGORITHM,
+        default_key=settings.AUTH_COOKIE_SECRET_KEY,
+        keys=tokens.parse_keys(settings.AUTH_COOKIE_SECRET_KEYS),
+        cache=cache.TTLCache(
+            maxsize=settings.AUTH_TOKEN_CACHE_SIZE,
+            ttl=settings.AUTH_TOKEN_CACHE_TTL,
+            name="tokens",
+        ),
+        options={"verify_exp": False},
+    )
+
+
+def _static_assets():
+    from shavon import settings
+    from shavon.utilities import assets
+
+    # Fingerprinted static files, loaded by each worker before serving
+    return assets.StaticAssets(
+        url_prefix=settings.STATIC_URL,
+        max_age=settings.STATIC_MAX_AGE,
+    )
+
+
+_FACTORIES = {
+    "db": _db,
+    "hash_executor": _hash_executor,
+    "password_hasher": _password_hasher,
+    "auth_cache": _auth_cache,
+    "lookups": _lookups,
+    "page_cache": _page_cache,
+    "token_codec": _token_codec,
+    "static_assets": _static_assets,
+}
+
+
+def __getattr__(name: str):
+    """ Build a shared object on first access and keep it as a module
+        attribute, so later lookups don't come back here.
+    """
+    factory = _FACTORIES.get(name)
+    if factory is None:
+        # Lets `from shavon import <submodule>` fall back to importing it
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = globals()[name] = factory()
+    return value
@@ -0,0 +1,4 @@
+""" Benchmarks for Shavon components.
+
+Each module can be run directly, e.g. `python -m shavon.bench.hashers`.
+"""
@@ -0,0 +1,95 @@
+""" Password hashing benchmark.
+
+Reports how many verifications per second a single core sustains for each
+scheme and cost setting, to help pick PASSWORD_HASH_SCHEME and
+PASSWORD_HASH_PARAMS for the available CPU capacity.
+
+    python -m shavon.bench.hashers
+    python -m shavon.bench.hashers pbkdf2-sha512:i=200000 scrypt:n=32768,r=8,p=1
+"""
+import argparse
+import json
+import os
+import time
+
+from shavon.utilities import passwords
+
+
+DEFAULT_TARGETS = [
+    "pbkdf2-sha512:i=50000",
+    "pbkdf2-sha512:i=100000",
+    "pbkdf2-sha512:i=200000",
+    "pbkdf2-sha256:i=300000",
+    "pbkdf2-sha256:i=600000",
+    "scrypt:n=16384,r=8,p=1",
+    "scrypt:n=32768,r=8,p=1",
+]
+
+
+def bench_hasher(
+    hasher: passwords.PasswordHasher,
+    duration: float = 1.0,
+) -> dict:
+    """ Verify a password repeatedly on one core for `duration` seconds.
+    """
+    hashed = hasher.hash("correct horse battery staple")
+
+    # Warm up once so one-off setup isn't measured
+    passwords.verify_password(hashed, "correct horse battery staple")
+
+    count = 0
+    started = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < duration:
+        passwords.verify_password(hashed, "correct horse battery staple")
+        count += 1
+        elapsed = time.perf_counter() - started
+
+    per_core = count / elapsed
+    return {
+        "scheme": hasher.scheme,
+        "params": hasher.params,
+        "verifications": count,
+        "seconds": round(elapsed, 4),
+        "ms_per_verify": round(1000 / per_core, 3),
+        "verifies_per_sec_per_core": round(per_core, 2),
+        "verifies_per_sec_all_cores": round(per_core * (os.cpu_count() or 1), 2),
+    }
+
+
+def main(argv: list[str] | None = None) -> list[dict]:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "targets",
+        nargs="*",
+        default=DEFAULT_TARGETS,
+        help="scheme:params pairs to benchmark, e.g. pbkdf2-sha512:i=100000",
+    )
+    parser.add_argument("--duration", type=float, default=1.0)
+    parser.add_argument("--json", action="store_true", help="Print JSON")
+    args = parser.parse_args(argv)
+
+    results = []
+    for target in args.targets:
+        scheme, _, params = target.partition(":")
+        results.append(
+            bench_hasher(passwords.get_hasher(scheme, params), args.duration)
+        )
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'scheme':<16}{'params':<24}{'ms/verify':>12}{'verify/s/core':>16}")
+        for result in results:
+            params = ",".join(f"{k}={v}" for k, v in result["params"].items())
+            print(
+                f"{result['scheme']:<16}{params:<24}"
+                f"{result['ms_per_verify']:>12}"
+                f"{result['verifies_per_sec_per_core']:>16}"
+            )
+
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,448 @@
+""" End-to-end load benchmark for Shavon's endpoints.
+
+Boots the app in this process against a benchmark database, seeds users and
+sessions, and drives each scenario with a keep-alive HTTP client at the
+given concurrency. Reports latency percentiles, requests per second, database
+queries per request and peak allocations per request.
+
+    python -m shavon.bench.load
+    python -m shavon.bench.load --db-url postgresql+asyncpg://u:p@localhost/bench
+    python -m shavon.bench.load --scenario login --json > before.json
+    python -m shavon.bench.load --compare before.json
+
+SQLite (through aiosqlite) is used by default as a stand-in for Postgres, in a
+fresh file. On other databases the tables are created if missing and only
+the benchmark's own users are replaced.
+
+Queries are counted on every engine while a scenario runs, so background
+writes made during it are included. Allocations are measured separately, on
+requests sent one at a time with tracemalloc running; they cover the client
+as well as the server. The peak includes the 256 KiB buffer asyncio reads
+each socket into, so changes matter more than the figure itself; retained is
+memory still held after the request, which should stay near zero.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import socket
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from typing import Any
+
+from sqlalchemy import delete, event
+from sqlalchemy.engine import Engine
+
+from shavon import db
+from shavon import settings
+
+
+SCENARIOS = ("index", "login", "profile_view", "profile_manage")
+
+BENCH_EMAIL = "bench-{}@bench.invalid"
+BENCH_PASSWORD = "bench password"
+
+
+class QueryCounter:
+    """ Counts the statements run by every engine while installed.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def _count(self, *args: Any) -> None:
+        self.count += 1
+
+    def __enter__(self) -> "QueryCounter":
+        event.listen(Engine, "after_cursor_execute", self._count)
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        event.remove(Engine, "after_cursor_execute", self._count)
+
+
+# HTTP CLIENT
+class Connection:
+    """ Minimal HTTP/1.1 keep-alive client connection, enough for our own
+        responses: Content-Length and chunked bodies.
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        body: bytes = b"",
+        headers: dict[str, str] | None = None,
+    ) -> tuple[int, bytes]:
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(
+                self.host, self.port
+            )
+
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}"]
+        lines += [f"{k}: {v}" for k, v in (headers or {}).items()]
+        lines.append(f"Content-Length: {len(body)}")
+        self._writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+        await self._writer.drain()
+
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionError("Server closed the connection")
+        status = int(status_line.split()[1])
+
+        response_headers = {}
+        while (line := await self._reader.readline()) not in (b"\r\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+
+        if response_headers.get("transfer-encoding") == "chunked":
+            chunks = []
+            while size := int((await self._reader.readline()).strip(), 16):
+                chunks.append(await self._reader.readexactly(size))
+                await self._reader.readline()
+            await self._reader.readline()
+            response_body = b"".join(chunks)
+        else:
+            length = int(response_headers.get("content-length", 0))
+            response_body = await self._reader.readexactly(length)
+
+        if response_headers.get("connection") == "close":
+            await self.close()
+        return status, response_body
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._reader = self._writer = None
+
+
+# SETUP
+async def seed(users: int) -> list[dict[str, Any]]:
+    """ Create the schema if needed and replace the benchmark users, each
+        with one session. Returns what the scenarios need for each user.
+    """
+    from shavon.models import ModelBase
+    from shavon.models.auth import User
+    from shavon.utilities.session import build_auth_token, state_store
+
+    async with db.engine.begin() as conn:
+        await conn.run_sync(ModelBase.metadata.create_all)
+
+    # Every user shares one hash; hashing each would dominate setup time
+    password = User.hash_password(BENCH_PASSWORD)
+    seeded = []
+    async with db.session() as session:
+        await session.execute(
+            delete(User).where(User.email.like(BENCH_EMAIL.format("%")))
+        )
+        accounts = [
+            User(email=BENCH_EMAIL.format(i), password=password, is_active=True)
+            for i in range(users)
+        ]
+        session.add_all(accounts)
+        await session.flush()
+
+        for user in accounts:
+            user_session = await state_store.create_session(
+                session=session,
+                user_id=user.id,
+                ip_address="127.0.0.1",
+                user_agent="shavon-bench",
+            )
+            token = build_auth_token(
+                user,
+                user_session.token,
+                user_session.session_key,
+            )
+            seeded.append({"id": user.id, "email": user.email, "cookie": token})
+
+        await session.commit()
+    return seeded
+
+
+def _requests(
+    scenario: str,
+    users: list[dict[str, Any]],
+) -> itertools.cycle:
+    """ Endless (method, path, body, headers) requests for a scenario,
+        cycling through the seeded users.
+    """
+    cookie = settings.AUTH_COOKIE_NAME
+    if scenario == "index":
+        requests = [("GET", "/", b"", {})]
+    elif scenario == "login":
+        requests = [
+            (
+                "POST",
+                "/auth/login/proc",
+                json.dumps({
+                    "email": user["email"],
+                    "password": BENCH_PASSWORD,
+                }).encode(),
+                {"Content-Type": "application/json"},
+            )
+            for user in users
+        ]
+    elif scenario == "profile_view":
+        requests = [
+            ("GET", f"/profile/view/{user['id']}", b"", {}) for user in users
+        ]
+    elif scenario == "profile_manage":
+        requests = [
+            ("GET", "/profile/manage", b"", {"Cookie": f"{cookie}={user['cookie']}"})
+            for user in users
+        ]
+    else:
+        raise ValueError(f"Unknown scenario: {scenario}")
+    return itertools.cycle(requests)
+
+
+# MEASUREMENT
+def _percentile(sorted_values: list[float], percent: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))
+    return sorted_values[index]
+
+
+async def run_scenario(
+    scenario: str,
+    users: list[dict[str, Any]],
+    host: str,
+    port: int,
+    requests: int,
+    concurrency: int,
+    warmup: int,
+    alloc_samples: int,
+) -> dict[str, Any]:
+    """ Send `requests` requests over `concurrency` connections and measure
+        them, after `warmup` unmeasured ones.
+    """
+    source = _requests(scenario, users)
+    connections = [Connection(host, port) for _ in range(concurrency)]
+
+    for _ in range(warmup):
+        await connections[0].request(*next(source))
+
+    latencies: list[float] = []
+    statuses: dict[str, int] = {}
+    remaining = itertools.count()
+
+    async def drive(connection: Connection) -> None:
+        while next(remaining) < requests:
+            started = time.perf_counter()
+            status, _ = await connection.request(*next(source))
+            latencies.append(time.perf_counter() - started)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    with QueryCounter() as queries:
+        started = time.perf_counter()
+        await asyncio.gather(*(drive(c) for c in connections))
+        elapsed = time.perf_counter() - started
+
+    # Memory allocated while serving a single request, and still held after
+    peaks = []
+    retained = []
+    tracemalloc.start()
+    try:
+        await connections[0].request(*next(source))
+        for _ in range(alloc_samples):
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+            await connections[0].request(*next(source))
+            current, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - baseline)
+            retained.append(current - baseline)
+    finally:
+        tracemalloc.stop()
+
+    for connection in connections:
+        await connection.close()
+
+    latencies.sort()
+    return {
+        "scenario": scenario,
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 4),
+        "rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+        "queries_per_request": round(queries.count / len(latencies), 3),
+        "alloc_peak_kib_per_request": (
+            round(statistics.fmean(peaks) / 1024, 2) if peaks else None
+        ),
+        "alloc_retained_kib_per_request": (
+            round(statistics.fmean(retained) / 1024, 2) if retained else None
+        ),
+        "statuses": statuses,
+    }
+
+
+def _free_port(host: str) -> int:
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+async def bench(args: argparse.Namespace) -> list[dict[str, Any]]:
+    """ Boot the app, seed it and run each scenario in turn.
+    """
+    # Imported here so the database is rebound before the app is built
+    from shavon.blueprints.auth import login_limiter
+    from shavon.launch import app
+
+    # Per-request log lines would be the bulk of the work measured, and
+    # Sanic logs to stdout along with --json output. Its one warning is that
+    # main process listeners, such as the reaper, don't run here.
+    logging.getLogger("shavon").setLevel(logging.WARNING)
+    for name in ("sanic.root", "sanic.server"):
+        logging.getLogger(name).setLevel(logging.ERROR)
+
+    # Measure the endpoints, not the flood protection in front of them
+    login_limiter.rate = 0
+    settings.LOGIN_CAPTCHA_AFTER = 2**31
+
+    users = await seed(args.users)
+
+    host, port = "127.0.0.1", _free_port("127.0.0.1")
+    server = await app.create_server(
+        host=host,
+        port=port,
+        access_log=False,
+        return_asyncio_server=True,
+    )
+    await server.startup()
+    await server.before_start()
+    await server.after_start()
+
+    results = []
+    try:
+        for scenario in args.scenarios:
+            results.append(await run_scenario(
+                scenario,
+                users,
+                host,
+                port,
+                requests=args.requests,
+                concurrency=args.concurrency,
+                warmup=args.warmup,
+                alloc_samples=args.alloc_samples,
+            ))
+    finally:
+        await server.before_stop()
+        server.close()
+        await server.wait_closed()
+        await server.after_stop()
+        await db.dispose()
+
+    return results
+
+
+def compare(baseline: list[dict], results: list[dict]) -> list[dict]:
+    """ Percentage change of each scenario's key figures from a baseline.
+    """
+    previous = {result["scenario"]: result for result in baseline}
+    changes = []
+    for result in results:
+        before = previous.get(result["scenario"])
+        if not before:
+            continue
+        change = {"scenario": result["scenario"]}
+        for key in (
+            "rps",
+            "p50_ms",
+            "p95_ms",
+            "p99_ms",
+            "queries_per_request",
+            "alloc_peak_kib_per_request",
+        ):
+            if before.get(key) and result[key] is not None:
+                change[key] = round((result[key] - before[key]) / before[key] * 100, 1)
+        changes.append(change)
+    return changes
+
+
+def main(argv: list[str] | None = None) -> list[dict]:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--scenario",
+        dest="scenarios",
+        action="append",
+        choices=SCENARIOS,
+        help="Scenario to run, may be repeated; all by default",
+    )
+    parser.add_argument(
+        "--db-url",
+        default=None,
+        help="Database to benchmark against; a fresh SQLite file by default",
+    )
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--alloc-samples", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="Print JSON")
+    parser.add_argument(
+        "--compare",
+        metavar="JSON_FILE",
+        help="Show changes from the results of an earlier --json run",
+    )
+    args = parser.parse_args(argv)
+    args.scenarios = args.scenarios or list(SCENARIOS)
+
+    db_url = args.db_url
+    if db_url is None:
+        path = os.path.join(tempfile.gettempdir(), "shavon-bench.db")
+        if os.path.exists(path):
+            os.unlink(path)
+        db_url = f"sqlite+aiosqlite:///{path}"
+    db.rebind(db_url)
+
+    results = asyncio.run(bench(args))
+
+    if args.json:
+        print(json.dumps({"db": db.engine.dialect.name, "results": results}, indent=2))
+    else:
+        print(
+            f"{'scenario':<16}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}"
+            f"{'p99 ms':>10}{'queries':>9}{'peak KiB':>10}{'kept KiB':>10}"
+            "  statuses"
+        )
+        for result in results:
+            print(
+                f"{result['scenario']:<16}{result['rps']:>10}"
+                f"{result['p50_ms']:>10}{result['p95_ms']:>10}"
+                f"{result['p99_ms']:>10}{result['queries_per_request']:>9}"
+                f"{result['alloc_peak_kib_per_request']!s:>10}"
+                f"{result['alloc_retained_kib_per_request']!s:>10}"
+                f"  {result['statuses']}"
+            )
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        for change in compare(baseline, results):
+            print(", ".join(
+                f"{key} {value:+}%" if key != "scenario" else value
+                for key, value in change.items()
+            ))
+
+    return results
+
+
+if __name__ == "__main__":
+    main()
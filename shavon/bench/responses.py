@@ -0,0 +1,133 @@
+""" JSON response benchmark.
+
+Compares how many of our API responses per second one core can build with
+the stdlib encoder Sanic uses by default, with `json_helpers.dumps` (orjson
+when installed) and with bodies prepared once.
+
+    python -m shavon.bench.responses
+    python -m shavon.bench.responses --json --duration 2
+"""
+import argparse
+import functools
+import json
+import time
+
+from typing import Any, Callable
+
+import sanic
+from pydantic import BaseModel
+
+from shavon.utilities import json_helpers
+
+
+class ProfileSummary(BaseModel):
+    id: int
+    email: str
+    is_active: bool
+    sessions: list[str]
+
+
+SAMPLE_MODEL = ProfileSummary(
+    id=42,
+    email="user@example.com",
+    is_active=True,
+    sessions=["a" * 43, "b" * 43, "c" * 43],
+)
+
+# What Sanic serializes with when no `dumps` is configured
+STDLIB_DUMPS = functools.partial(json.dumps, separators=(",", ":"))
+
+
+def _cases() -> dict[str, dict[str, Callable[[], Any]]]:
+    """ Ways of building each response, keyed by response then method.
+    """
+    invalid = json_helpers.fail_json(
+        message="Invalid credentials or account inactive."
+    )
+    prepared_invalid = json_helpers.PreparedJSON(invalid)
+    login_ok = json_helpers.ok_json(redirect_url="/profile/view/42")
+
+    return {
+        "invalid_credentials": {
+            "stdlib": lambda: sanic.json(invalid, dumps=STDLIB_DUMPS),
+            "dumps": lambda: json_helpers.fail_response(
+                message="Invalid credentials or account inactive."
+            ),
+            "prepared": prepared_invalid.response,
+        },
+        "login_ok": {
+            "stdlib": lambda: sanic.json(login_ok, dumps=STDLIB_DUMPS),
+            "dumps": lambda: json_helpers.ok_response(
+                redirect_url="/profile/view/42"
+            ),
+        },
+        "model": {
+            "stdlib": lambda: sanic.json(
+                SAMPLE_MODEL.model_dump(mode="json"),
+                dumps=STDLIB_DUMPS,
+            ),
+            "dumps": lambda: json_helpers.ok_response(profile=SAMPLE_MODEL),
+            "model_response": lambda: json_helpers.model_response(SAMPLE_MODEL),
+        },
+    }
+
+
+def bench_case(build: Callable[[], Any], duration: float = 1.0) -> dict:
+    """ Build a response repeatedly for `duration` seconds.
+    """
+    build()
+
+    count = 0
+    started = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < duration:
+        # Check the clock every 100 builds so it isn't what's measured
+        for _ in range(100):
+            build()
+        count += 100
+        elapsed = time.perf_counter() - started
+
+    return {
+        "responses": count,
+        "seconds": round(elapsed, 4),
+        "us_per_response": round(elapsed / count * 1e6, 3),
+        "responses_per_sec": round(count / elapsed, 2),
+    }
+
+
+def main(argv: list[str] | None = None) -> list[dict]:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--duration", type=float, default=1.0)
+    parser.add_argument("--json", action="store_true", help="Print JSON")
+    args = parser.parse_args(argv)
+
+    results = []
+    for response, methods in _cases().items():
+        for method, build in methods.items():
+            results.append({
+                "response": response,
+                "method": method,
+                **bench_case(build, args.duration),
+            })
+
+    if args.json:
+        print(json.dumps({
+            "orjson": json_helpers.orjson is not None,
+            "results": results,
+        }, indent=2))
+    else:
+        encoder = "orjson" if json_helpers.orjson is not None else "stdlib"
+        print(f"json_helpers.dumps uses {encoder}")
+        print(f"{'response':<22}{'method':<16}{'us/response':>12}{'responses/s':>14}")
+        for result in results:
+            print(
+                f"{result['response']:<22}{result['method']:<16}"
+                f"{result['us_per_response']:>12}"
+                f"{result['responses_per_sec']:>14}"
+            )
+
+    return results
+
+
+if __name__ == "__main__":
+    main()
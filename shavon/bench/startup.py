@@ -0,0 +1,126 @@
+""" Import time breakdown of Shavon's entry points.
+
+Imports each module in a fresh interpreter with `python -X importtime` and
+reports the total, the slowest modules including what they import, and the
+time spent in each top-level package's own code.
+
+    python -m shavon.bench.startup
+    python -m shavon.bench.startup shavon.launch shavon.models.auth --top 30
+    python -m shavon.bench.startup --json > before.json
+    python -m shavon.launch --import-times
+
+shavon.launch is what each worker imports; shavon.models.auth is roughly what
+Alembic and other tooling import.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from typing import Any
+
+
+ENTRY_POINTS = ("shavon.launch", "shavon.models.auth")
+
+
+def measure(module: str) -> list[dict[str, Any]]:
+    """ Import times of every module imported by `import module`, in import
+        order. Times are in milliseconds; `depth` is how deep in the import
+        tree a module was first imported.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)},
+    )
+    if completed.returncode:
+        raise RuntimeError(f"Importing {module} failed:\n{completed.stderr}")
+
+    entries = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        entries.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000,
+        })
+    return entries
+
+
+def summarize(module: str, entries: list[dict], top: int) -> dict[str, Any]:
+    """ Total, slowest modules and time by top-level package.
+    """
+    packages: dict[str, float] = {}
+    for entry in entries:
+        package = entry["module"].split(".")[0]
+        packages[package] = packages.get(package, 0.0) + entry["self_ms"]
+
+    slowest = sorted(entries, key=lambda e: e["cumulative_ms"], reverse=True)
+    return {
+        "module": module,
+        "total_ms": round(sum(e["cumulative_ms"] for e in entries if e["depth"] == 0), 1),
+        "modules": len(entries),
+        "slowest": [
+            {
+                "module": e["module"],
+                "cumulative_ms": round(e["cumulative_ms"], 1),
+                "self_ms": round(e["self_ms"], 1),
+            }
+            for e in slowest[:top]
+        ],
+        "packages": {
+            package: round(ms, 1)
+            for package, ms in sorted(
+                packages.items(), key=lambda item: item[1], reverse=True,
+            )[:top]
+        },
+    }
+
+
+def main(argv: list[str] | None = None) -> list[dict]:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "modules",
+        nargs="*",
+        metavar="MODULE",
+        help=f"Modules to import; {', '.join(ENTRY_POINTS)} by default",
+    )
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--json", action="store_true", help="Print JSON")
+    args = parser.parse_args(argv)
+
+    results = [
+        summarize(module, measure(module), args.top)
+        for module in args.modules or ENTRY_POINTS
+    ]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return results
+
+    for result in results:
+        print(
+            f"import {result['module']}: {result['total_ms']} ms, "
+            f"{result['modules']} modules"
+        )
+        print(f"  {'cumulative ms':>13}{'self ms':>10}  module")
+        for entry in result["slowest"]:
+            print(
+                f"  {entry['cumulative_ms']:>13}{entry['self_ms']:>10}"
+                f"  {entry['module']}"
+            )
+        print(f"  {'self ms':>13}  package")
+        for package, ms in result["packages"].items():
+            print(f"  {ms:>13}  {package}")
+        print()
+
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -6,5 +6,7 @@ BLUEPRINTS_ENABLED: List[Tuple[str, str]] = [
     ("shavon.blueprints.auth", "blueprint"),
     ("shavon.blueprints.onboarding", "blueprint"),
     ("shavon.blueprints.profile", "blueprint"),
+    ("shavon.blueprints.metrics", "blueprint"),
+    ("shavon.blueprints.assets", "blueprint"),
 ]
 
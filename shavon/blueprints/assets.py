@@ -0,0 +1,24 @@
+import sanic
+
+from sanic.exceptions import NotFound
+
+from shavon import settings
+from shavon import static_assets
+
+
+blueprint = sanic.Blueprint("assets", url_prefix=settings.STATIC_URL)
+
+
+@blueprint.route("/<path:path>", methods=["GET", "HEAD"], name="asset")
+async def asset(request, path):
+    """
+    Serve a built static asset, precompressed when the client accepts it.
+    """
+    response = static_assets.response(
+        path,
+        accept_encoding=request.headers.get("accept-encoding", ""),
+        if_none_match=request.headers.get("if-none-match", ""),
+    )
+    if response is None:
+        raise NotFound("Not found")
+    return response
@@ -1,68 +1,100 @@
-import jwt
+import logging
 import sanic
 
 from pydantic import ValidationError
 from sqlalchemy import select
 
-from shavon import db
 from shavon import settings
-from shavon.models.auth import (
-    User,
-    LoginAttempt,
-)
-from shavon.models.session import Session
+from shavon.models.auth import User
 from shavon.utilities.session import (
     auth_required,
-    clear_cookie
+    build_auth_token,
+    clear_cookie,
+    revoke_session,
+    set_auth_cookie,
+    state_store,
 )
-from shavon.utilities.templating import render_template
+from shavon.utilities.middleware import request_session, transactional
+from shavon.utilities.pagecache import cached_page
+from shavon.utilities.templating import stream_template
+from shavon.utilities.ratelimit import TokenBucketLimiter
 from shavon.utilities.json_helpers import (
+    PreparedJSON,
+    fail_json,
     fail_response,
     ok_response
 )
 from shavon.validators.auth import LoginForm
-from shavon.exceptions import ProcessingBreak
+from shavon.exceptions import (
+    ProcessingBreak,
+    ServiceBusy,
+)
 
 blueprint = sanic.Blueprint("auth", url_prefix="/auth")
 
+logger = logging.getLogger(__name__)
+
+# Per-worker flood protection for login_proc, keyed by client IP
+login_limiter = TokenBucketLimiter(
+    rate=settings.LOGIN_RATE_LIMIT,
+    burst=settings.LOGIN_RATE_BURST,
+)
+
+# Bodies sent unchanged on every failed or throttled login
+GENERIC_LOGIN_ERROR = "Invalid credentials or account inactive."
+INVALID_CREDENTIALS = PreparedJSON(fail_json(message=GENERIC_LOGIN_ERROR))
+TOO_MANY_ATTEMPTS = PreparedJSON(fail_json(
+    message="Too many login attempts, please try again shortly.",
+    retry=True,
+))
+
 
 @blueprint.route("/login", methods=["GET"], name="login")
+@cached_page()
 async def login(request):
     """ Render the login page.
     """
-    html_page = render_template(
-        "auth/login.html", 
+    return await stream_template(
+        "auth/login.html",
         settings=settings,
         request=request,
     )
 
-    return sanic.response.html(html_page)
-
 
 @blueprint.route("/login/proc", methods=["POST"], name="login_proc")
+@transactional
 async def login_proc(request):
     """ Process the login form.
     """
 
-    # Get/Create LoginAttempt record for the IP address
-    async with db.session() as session:
-        login_attempt = await LoginAttempt.get_attempt(
-            session=session,
-            ip_address=request.ip,
+    # Turn away floods from one IP before they reach the database
+    if not login_limiter.allow(request.ip):
+        return TOO_MANY_ATTEMPTS.response(
+            http_status=429,
+            headers={"Retry-After": str(login_limiter.retry_after(request.ip))},
         )
-        await session.flush()
 
-        print(f"Login attempt for IP: {request.ip}, Current attempts: {login_attempt.attempt_count}")	
-        # Increment the attempt count
-        login_attempt.increment()
-        session.add(login_attempt)
-        await session.commit()
+    # One session for the whole request, committed once the response is built
+    session = await request_session(request)
+
+    # Count the attempt for the IP address
+    attempt_count = await state_store.register_attempt(
+        session=session,
+        ip_address=request.ip,
+    )
+
+    require_captcha = bool(attempt_count > settings.LOGIN_CAPTCHA_AFTER)
+    logger.info(
+        "Login attempt",
+        extra={
+            "ip": request.ip,
+            "attempts": attempt_count,
+            "captcha_required": require_captcha,
+        },
+    )
 
-    generic_error = "Invalid credentials or account inactive."
     try:
         # Validate the form data
-        require_captcha = bool(login_attempt.attempt_count > 3)
-        print(f"Captcha required: {require_captcha}")
         auth_form = LoginForm(
             require_captcha=require_captcha,
             captcha=None,
@@ -72,89 +104,93 @@ async def login_proc(request):
         # TODO: Check captcha if required
 
         # Check credentials
-        async with db.session() as session:
-            email = auth_form.email.lower()
-            result = await session.execute(
-                select(User).where(User.email == email)
-            )
-            user: User = result.scalars().first()
-            if not user or not user.is_active:
-                raise ProcessingBreak(generic_error)
-            
-            # Verify the password
-            if not user.verify_password(
-                hashed_password=user.password,
-                pt_password=auth_form.password
-            ):
-                raise ProcessingBreak(generic_error)
+        email = auth_form.email.lower()
+        result = await session.execute(
+            select(User).where(User.email == email)
+        )
+        user: User = result.scalars().first()
+        if not user or not user.is_active:
+            raise ProcessingBreak(GENERIC_LOGIN_ERROR)
+        
+        # Verify the password off the event loop
+        if not await user.verify_password_async(
+            hashed_password=user.password,
+            pt_password=auth_form.password
+        ):
+            raise ProcessingBreak(GENERIC_LOGIN_ERROR)
+
+        # Upgrade the stored hash if the configured scheme has changed.
+        # A busy hashing pool just defers the upgrade to a later login.
+        if user.needs_rehash(user.password):
+            try:
+                user.password = await user.hash_password_async(
+                    auth_form.password
+                )
+                session.add(user)
+            except ServiceBusy:
+                pass
                     
-    except (ValidationError, ProcessingBreak) as e:
-        # Handle validation errors or processing breaks
+    except ProcessingBreak as e:
+        # Most failed logins share one body, serialized once
+        if e.message == GENERIC_LOGIN_ERROR:
+            return INVALID_CREDENTIALS.response()
+        return fail_response(message=str(e))
+
+    except ValidationError as e:
+        # Handle validation errors
         return fail_response(message=str(e))
-    
-    except Exception as e:
-        # Handle unexpected errors
-        return fail_response(message="An unexpected error occurred: " + str(e))
+
+    except ServiceBusy as e:
+        # The hashing pool is saturated, ask the client to retry
+        return fail_response(
+            http_status=503,
+            headers={"Retry-After": str(e.retry_after)},
+            message=str(e),
+            retry=True,
+        )
 
     # Clear the login attempt record
-    async with db.session() as session:
-        await session.delete(login_attempt)
-        await session.commit()
+    await state_store.clear_attempts(session=session, ip_address=request.ip)
 
     # Create a new session record
-    async with db.session() as session:
-        user_session = await Session.create_session(
-            session=session,
-            user_id=user.id,
-            ip_address=request.ip,
-            user_agent=request.headers.get('user-agent', ''),
-        )
-        await session.commit()
-
-    # Start with an ok_response
-    response = ok_response()
-
-    # Built the JWT payload with session key
-    payload = { 
-        "user_id": user.id,
-        "session_key": user_session.session_key,
-    }
-
-    # Build the access_token
-    access_token = jwt.encode(
-        payload,
-        settings.AUTH_COOKIE_SECRET_KEY,
-        algorithm=settings.AUTH_COOKIE_ALGORITHM,
+    user_session = await state_store.create_session(
+        session=session,
+        user_id=user.id,
+        ip_address=request.ip,
+        user_agent=request.headers.get('user-agent', ''),
+    )
+
+    # Build the access_token with the session's token
+    access_token = build_auth_token(
+        user,
+        user_session.token,
+        user_session.session_key,
     )
     
     # Build the response and attach the cookie
     response = ok_response(
         redirect_url=request.app.url_for("profile.view", user_id=user.id)
     )
-    response.add_cookie(
-        settings.AUTH_COOKIE_NAME,
-        access_token,
-        domain=settings.AUTH_COOKIE_DOMAIN,
-        max_age=settings.AUTH_COOKIE_LIFESPAN,
-    )
-    return response
+    return set_auth_cookie(response, access_token)
 
 
 @blueprint.route("/logout", methods=["GET"], name="logout")
+@transactional
 @auth_required
 async def logout(request):
     """ Log out the user by destroying their session.
     """
 
     # Delete the session from the database
-    async with db.session() as session:
-        # Get the session key from the cookie
-        user_session = request.ctx.session
-        
-        # If a session exists, delete it
-        if user_session:
-            await session.delete(user_session)
-            await session.commit()
+    session = await request_session(request)
+
+    # Get the session key from the cookie
+    user_session = request.ctx.session
+    
+    # If a session exists, delete it
+    if user_session:
+        await revoke_session(session, user_session)
+        await state_store.delete_session(session, user_session)
 
     # Redirect to the login page
     response = sanic.response.redirect(
@@ -1,21 +1,20 @@
 import sanic
 
 from shavon import settings
-from shavon.utilities.templating import render_template
+from shavon.utilities.pagecache import cached_page
+from shavon.utilities.templating import stream_template
 
 
 blueprint = sanic.Blueprint("info", url_prefix="/")
 
 @blueprint.route("/", methods=["GET"])
+@cached_page()
 async def index(request):
     """
     Render the index page.
     """
-    response = sanic.response.html(
-        render_template(
-            "info/index.html", 
-            settings=settings,
-            request=request
-        )
+    return await stream_template(
+        "info/index.html",
+        settings=settings,
+        request=request
     )
-    return response
@@ -0,0 +1,113 @@
+import hmac
+import sanic
+
+from sanic.exceptions import NotFound
+
+from shavon import auth_cache
+from shavon import hash_executor
+from shavon import lookups
+from shavon import page_cache
+from shavon import settings
+from shavon import token_codec
+from shavon.blueprints.auth import login_limiter
+from shavon.models.session import last_accessed_writer
+from shavon.utilities import metrics
+from shavon.utilities.session import revocation_list
+
+
+blueprint = sanic.Blueprint("metrics", url_prefix="/")
+
+CACHE_SIZE = metrics.registry.gauge(
+    "shavon_cache_entries", "Entries held by a cache.", ("cache",)
+)
+CACHE_HITS = metrics.registry.counter(
+    "shavon_cache_hits_total", "Cache lookups that found an entry.", ("cache",)
+)
+CACHE_MISSES = metrics.registry.counter(
+    "shavon_cache_misses_total", "Cache lookups that found nothing.", ("cache",)
+)
+CACHE_EVICTIONS = metrics.registry.counter(
+    "shavon_cache_evictions_total", "Entries evicted to make room.", ("cache",)
+)
+EXECUTOR_PENDING = metrics.registry.gauge(
+    "shavon_executor_pending", "Calls running or queued on a pool.", ("pool",)
+)
+EXECUTOR_REJECTED = metrics.registry.counter(
+    "shavon_executor_rejected_total", "Calls turned away by a full pool.", ("pool",)
+)
+LIMITER_REJECTED = metrics.registry.counter(
+    "shavon_ratelimit_rejected_total", "Requests over a rate limit.", ("limiter",)
+)
+WRITER_PENDING = metrics.registry.gauge(
+    "shavon_writer_pending", "Writes waiting for the next flush.", ("writer",)
+)
+WRITER_FLUSHED = metrics.registry.counter(
+    "shavon_writer_flushed_total", "Writes flushed in batches.", ("writer",)
+)
+FLIGHT_CALLS = metrics.registry.counter(
+    "shavon_singleflight_calls_total", "Calls run for their key.", ("flight",)
+)
+FLIGHT_COALESCED = metrics.registry.counter(
+    "shavon_singleflight_coalesced_total",
+    "Calls that shared the result of one already in flight.",
+    ("flight",),
+)
+REVOCATIONS = metrics.registry.gauge(
+    "shavon_revocations", "Entries in the revocation list."
+)
+
+
+@metrics.registry.collector
+def collect_component_stats():
+    """
+    Copy the counters kept by caches, pools, limiters, single-flights and
+    writers.
+    """
+    for cache in (auth_cache, token_codec.cache, page_cache):
+        stats = cache.stats()
+        CACHE_SIZE.set(stats["size"], cache.name)
+        CACHE_HITS.set(stats["hits"], cache.name)
+        CACHE_MISSES.set(stats["misses"], cache.name)
+        CACHE_EVICTIONS.set(stats["evictions"], cache.name)
+
+    EXECUTOR_PENDING.set(hash_executor.pending, hash_executor.name)
+    EXECUTOR_REJECTED.set(hash_executor.rejected, hash_executor.name)
+    LIMITER_REJECTED.set(login_limiter.rejected, "login")
+    FLIGHT_CALLS.set(lookups.calls, lookups.name)
+    FLIGHT_COALESCED.set(lookups.coalesced, lookups.name)
+    WRITER_PENDING.set(len(last_accessed_writer), last_accessed_writer.name)
+    WRITER_FLUSHED.set(last_accessed_writer.flushed, last_accessed_writer.name)
+    REVOCATIONS.set(len(revocation_list))
+
+
+def _authorized(request: sanic.Request) -> bool:
+    """
+    Check the client's address against METRICS_ALLOWED_IPS and, when
+    METRICS_TOKEN is set, its bearer token.
+    """
+    allowed = settings.METRICS_ALLOWED_IPS
+    if allowed and request.ip not in allowed:
+        return False
+
+    if settings.METRICS_TOKEN:
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        return scheme.lower() == "bearer" and hmac.compare_digest(
+            token.strip().encode(),
+            settings.METRICS_TOKEN.encode(),
+        )
+    return True
+
+
+@blueprint.route("/_metrics", methods=["GET"], name="metrics")
+async def metrics_view(request):
+    """
+    Serve the metrics of every worker on this host in Prometheus format.
+    """
+    if not settings.METRICS_ENABLED or not _authorized(request):
+        raise NotFound("Not found")
+
+    snapshots = metrics.read_snapshots(settings.METRICS_DIR)
+    return sanic.text(
+        metrics.render(metrics.merge(snapshots)),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
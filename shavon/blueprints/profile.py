@@ -4,7 +4,8 @@ from sanic.exceptions import NotFound
 from shavon import db
 from shavon import settings
 from shavon.models.auth import User 
-from shavon.utilities.templating import render_template
+from shavon.utilities.pagecache import versioned_page
+from shavon.utilities.templating import stream_template
 from shavon.utilities.session import auth_required
 
 
@@ -19,33 +20,42 @@ async def profile_manage(request):
     # User is attached to request.ctx by the decorator
     user = request.ctx.user
     
-    response = sanic.response.html(
-        render_template(
-            "profile/manage.html", 
-            settings=settings,
-            request=request,
-            user=user
-        )
+    return await stream_template(
+        "profile/manage.html",
+        settings=settings,
+        request=request,
+        user=user
     )
-    return response
 
 @blueprint.route("/view/<user_id:int>", methods=["GET"], name="view")
 async def profile_view(request, user_id: int):
     """
     Render the view profile page for a specific user.
     """
-    async with db.session() as session:
-        # Fetch user details from the database
-        user = await User.get_by_id(session=session, user_id=user_id)
-        if not user:
-            raise NotFound(f"Could not find user.")
-        
-    response = sanic.response.html(
-        render_template(
-            "profile/view.html", 
+    async with db.session(readonly=True) as session:
+        # Only the version is read to serve a cached or unchanged page
+        version = await User.get_version(session=session, user_id=user_id)
+    if not version:
+        raise NotFound(f"Could not find user.")
+
+    async def render():
+        async with db.session(readonly=True) as session:
+            # Fetch user details from a read replica
+            user = await User.get_by_id(session=session, user_id=user_id)
+            if not user:
+                raise NotFound(f"Could not find user.")
+
+        return await stream_template(
+            "profile/view.html",
             settings=settings,
             request=request,
             user=user
         )
+
+    return await versioned_page(
+        request,
+        key=(user_id, version.version),
+        modified=version.updated_at,
+        render=render,
+        ttl=settings.PROFILE_CACHE_TTL,
     )
-    return response
\ No newline at end of file
@@ -11,3 +11,16 @@ class ProcessingBreak(Exception):
     def __str__(self):
         return self.message
 
+
+class ServiceBusy(Exception):
+    """ Exception raised when a bounded resource is saturated and the caller
+        should retry after `retry_after` seconds.
+    """
+
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = retry_after
+
+    def __str__(self):
+        return self.message
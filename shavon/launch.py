@@ -1,35 +1,255 @@
+import argparse
 import sanic
+import logging
 import importlib
+import os
 
+from shavon import db
 from shavon import settings
+from shavon import hash_executor
+from shavon import static_assets
+from shavon.blueprints import BLUEPRINTS_ENABLED
+from shavon.utilities import assets
+from shavon.utilities import json_helpers
+from shavon.utilities import metrics
+from shavon.utilities import templating
+from shavon.utilities.logs import configure_logging
+from shavon.utilities.middleware import register_middleware
+
+# Send Shavon's logs to stderr
+configure_logging(settings.LOG_LEVEL, settings.LOG_FORMAT)
+logger = logging.getLogger("shavon.launch")
+
+# Per-worker metrics snapshots, merged by /_metrics
+metrics_writer = metrics.SnapshotWriter(
+    settings.METRICS_DIR,
+    interval=settings.METRICS_INTERVAL,
+)
+
+# Create a Sanic app instance, serializing JSON with orjson when available
+app = sanic.Sanic(settings.APP_NAME, dumps=json_helpers.dumps)
+app.config.update(
+    USE_UVLOOP=settings.APP_USE_UVLOOP,
+    KEEP_ALIVE=settings.APP_KEEP_ALIVE,
+    KEEP_ALIVE_TIMEOUT=settings.APP_KEEP_ALIVE_TIMEOUT,
+    GRACEFUL_SHUTDOWN_TIMEOUT=settings.APP_GRACEFUL_SHUTDOWN_TIMEOUT,
+)
+
+# Attach request-scoped database sessions
+register_middleware(app)
+
+def register_blueprints(app: sanic.Sanic) -> None:
+    """ Import the enabled blueprints and attach them to the app.
+    """
+    for module_name, bp_name in BLUEPRINTS_ENABLED:
+        try:
+            loaded_module = importlib.import_module(module_name)
+            loaded_bp = getattr(loaded_module, bp_name, None)
+            if not loaded_bp:
+                raise ImportError(f"Blueprint {module_name}.{bp_name} not found.")
+
+            # Register the blueprint with the app
+            app.blueprint(loaded_bp)
+            logger.debug("Registered blueprint", extra={"blueprint": module_name})
+
+        except (ImportError, ModuleNotFoundError) as err:
+            logger.error(
+                "Could not load blueprint",
+                extra={"blueprint": module_name, "error": str(err)},
+            )
+            raise err
+
+
+# Attach Blueprints. The process running `python -m shavon.launch` only
+# manages the workers, which import this module again as __mp_main__ and
+# serve the routes, so it skips importing the blueprints and the auth and
+# model modules they use. Listeners import those when they run, for the
+# same reason
+if __name__ != "__main__":
+    from shavon.utilities.session import reissue_auth_cookie
+
+    register_blueprints(app)
+
+    # Send auth tokens reissued by auth_required
+    app.register_middleware(reissue_auth_cookie, "response")
+
+
+@app.main_process_ready
+async def start_state_store(app):
+    """ Run the shared state store process next to the workers, when the
+        socket store is in use.
+    """
+    if settings.STATE_STORE == "socket" and settings.STATE_STORE_SERVE:
+        from shavon.stores.local_socket import run_server as run_state_store
+
+        app.manager.manage(
+            "ShavonStateStore",
+            run_state_store,
+            {"path": settings.STATE_STORE_SOCKET},
+        )
+
+
+@app.main_process_start
+async def clear_metrics(app):
+    """ Drop metrics snapshots left by workers of a previous run.
+    """
+    if settings.METRICS_ENABLED:
+        metrics.clear_snapshots(settings.METRICS_DIR)
+
+
+@app.main_process_start
+async def build_static_assets(app):
+    """ Fingerprint and compress static files once, before workers load them.
+    """
+    if settings.STATIC_BUILD_ON_START:
+        assets.build(settings.STATIC_PATH, settings.STATIC_BUILD_PATH)
+
+
+@app.main_process_ready
+async def start_reaper(app):
+    """ Run the stale row reaper in its own process, unless disabled.
+    """
+    if settings.REAPER_INTERVAL > 0:
+        from shavon.reaper import run_reaper
+
+        app.manager.manage(
+            "ShavonReaper",
+            run_reaper,
+            {"interval": settings.REAPER_INTERVAL},
+        )
+
+
+@app.before_server_start
+async def connect_database(app):
+    """ Build this worker's engines and pools, after the worker process has
+        started rather than in the process that spawned it.
+    """
+    db.connect()
+
+
+@app.before_server_start
+async def load_static_assets(app):
+    """ Read the built static files into this worker's memory.
+    """
+    static_assets.load(settings.STATIC_PATH, settings.STATIC_BUILD_PATH)
+
+
+@app.before_server_start
+async def setup_templates(app):
+    """ Build the template environment once per worker.
+    """
+    templating.init_env(settings)
+
+
+# Shutdown listeners run in reverse order of registration, so this runs after
+# the pending writes below have been flushed.
+@app.before_server_stop
+async def dispose_database(app):
+    """ Close the worker's pooled database connections.
+    """
+    await db.dispose()
+
+
+@app.after_server_start
+async def start_background_writers(app):
+    """ Start the batched session last_accessed writer.
+    """
+    from shavon.models.session import last_accessed_writer
+
+    last_accessed_writer.start()
+
+
+@app.after_server_start
+async def start_metrics_writer(app):
+    """ Start writing this worker's metrics for /_metrics to merge.
+    """
+    if settings.METRICS_ENABLED:
+        metrics_writer.start()
+
+
+@app.before_server_stop
+async def stop_metrics_writer(app):
+    """ Write this worker's final metrics.
+    """
+    if settings.METRICS_ENABLED:
+        await metrics_writer.stop()
+
+
+@app.after_server_start
+async def start_revocation_list(app):
+    """ Start reading sessions revoked by any worker.
+    """
+    from shavon.utilities.session import revocation_list
+
+    revocation_list.start()
+
+
+@app.before_server_stop
+async def flush_background_writers(app):
+    """ Write pending session touches before the worker exits.
+    """
+    from shavon.models.session import last_accessed_writer
+
+    await last_accessed_writer.stop()
+
+
+@app.before_server_stop
+async def stop_revocation_list(app):
+    """ Stop reading revoked sessions.
+    """
+    from shavon.utilities.session import revocation_list
+
+    await revocation_list.stop()
+
+
+@app.after_server_stop
+async def shutdown_executors(app):
+    """ Stop the password hashing pool threads.
+    """
+    hash_executor.shutdown()
+
+
+def worker_count(workers: str) -> int:
+    """ Parse APP_WORKERS: a number of processes, or "auto" for one per CPU
+        core available to this process.
+    """
+    if workers != "auto":
+        return max(1, int(workers))
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
 
-# Create a Sanic app instance
-app = sanic.Sanic(settings.APP_NAME)
-
-# Attach Static directory for serving static files
-app.static('/static', './static')
-
-# Attach Blueprints
-for module_name, bp_name in settings.BLUEPRINTS_ENABLED:
-    try:
-        loaded_module = importlib.import_module(module_name)
-        loaded_bp = getattr(loaded_module, bp_name, None)
-        if not loaded_bp:
-            raise ImportError(f"Blueprint {module_name}.{bp_name} not found.")
-        
-        # Register the blueprint with the app
-        app.blueprint(loaded_bp)
-        # TODO: This should be logged to output log
-
-    except (ImportError, ModuleNotFoundError) as err:
-        # TODO: This should be logged to error log
-        raise err
-    
 # Run the server
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the Shavon server.")
+    parser.add_argument(
+        "--import-times",
+        action="store_true",
+        help="Report what a worker spends importing, instead of serving",
+    )
+    args = parser.parse_args()
+    workers = worker_count(settings.APP_WORKERS)
+
+    # Each worker would have its own memory store, and sessions created by
+    # one would be unknown to the others
+    if settings.STATE_STORE == "memory" and workers > 1:
+        parser.error(
+            "STATE_STORE=memory only works with one worker; use "
+            "STATE_STORE=socket or postgres, or set APP_WORKERS=1"
+        )
+
+    if args.import_times:
+        from shavon.bench import startup
+        startup.main(["shavon.launch"])
+        raise SystemExit
+
     app.run(
         host=settings.APP_HOST,
         port=settings.APP_PORT,
         debug=settings.APP_DEBUG,
+        workers=workers,
+        backlog=settings.APP_BACKLOG,
+        access_log=settings.APP_ACCESS_LOG,
     )
 
@@ -1,6 +1,87 @@
+import sqlalchemy as sa
+
+from typing import Any, Awaitable, Callable
+
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import DeclarativeBase
 
+from shavon import lookups
+from shavon import settings
+
+
+async def _merge(session: AsyncSession, loaded: Any) -> Any:
+    """ Copy instances loaded by another session into this one, without a
+        query. Instances may be inside a plain tuple; other values, named
+        tuples included, are returned as they are.
+    """
+    if type(loaded) is tuple:
+        return tuple([await _merge(session, item) for item in loaded])
+    if isinstance(loaded, ModelBase):
+        return await session.merge(loaded, load=False)
+    return loaded
+
 
 class ModelBase(DeclarativeBase):
-    ...
 
+    @classmethod
+    async def load_once(
+        cls,
+        session: AsyncSession,
+        key: tuple,
+        load: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        """ Await `load`, sharing it with concurrent callers that pass the
+            same key, so a burst of identical lookups runs one query. Callers
+            that waited get the instances merged into their own session.
+            Anything `load` returns other than instances, such as rows, is
+            shared as is and shouldn't be modified.
+            Sessions with changes of their own always run their own `load`.
+            A caller may get a result read just before a change it depends
+            on, so this is only for public data, never for auth state such
+            as sessions that a logout must end straight away.
+        """
+        sync_session = session.sync_session
+        if (
+            not settings.SINGLE_FLIGHT_ENABLED
+            or getattr(sync_session, "has_written", False)
+            or sync_session.new
+            or sync_session.dirty
+            or sync_session.deleted
+        ):
+            return await load()
+
+        # Replicas may lag, so their reads aren't shared with the primary's
+        replica = getattr(sync_session, "replica", None) is not None
+        loaded, shared = await lookups.do((cls.__name__, replica, *key), load)
+        if not shared:
+            return loaded
+
+        try:
+            return await _merge(session, loaded)
+        except sa.exc.InvalidRequestError:
+            # The caller that loaded them changed the instances already
+            return await load()
+
+    @classmethod
+    async def delete_batch(
+        cls,
+        session: AsyncSession,
+        *conditions: sa.ColumnElement[bool],
+        limit: int,
+    ) -> int:
+        """ Delete up to `limit` rows matching `conditions`, skipping rows
+            locked by other transactions. Returns the number deleted.
+        """
+        key = cls.__mapper__.primary_key[0]
+        batch = (
+            sa.select(key)
+            .where(*conditions)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        result = await session.execute(
+            sa.delete(cls)
+            .where(key.in_(batch))
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount
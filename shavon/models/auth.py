@@ -1,10 +1,10 @@
 from __future__ import annotations
 
-import binascii
-import hashlib
-import os
+from datetime import datetime
+from typing import NamedTuple
 
 import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import (
     mapped_column,
     Mapped,
@@ -12,10 +12,34 @@ from sqlalchemy.orm import (
 
 from shavon.models import ModelBase
 from shavon.utilities import dthelpers
+from shavon.utilities import passwords
 from shavon import db
+from shavon import hash_executor
+from shavon import password_hasher
 from shavon.utilities.dbhelpers import AsyncDatabaseConnection
 
 
+# INSERT constructs supporting ON CONFLICT, by dialect name
+UPSERT_INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+class AuthUser(NamedTuple):
+    """ The signed in user as auth sees them. Unlike a User it is complete
+        and immutable, so it can be cached and shared between requests.
+        Stateless tokens don't carry the email, which is then None.
+    """
+    id: int
+    email: str | None
+    is_active: bool
+
+    @classmethod
+    def from_user(cls, user: User) -> AuthUser:
+        return cls(id=user.id, email=user.email, is_active=user.is_active)
+
+
 class User(ModelBase):
     __tablename__ = "users"
     __table_args__ = (
@@ -40,6 +64,19 @@ class User(ModelBase):
         nullable=False,
         default=dthelpers.now,
     )
+    # Bumped by mark_changed when something shown on the profile changes;
+    # caches of rendered user data are keyed by it
+    version: Mapped[int] = mapped_column(
+        sa.Integer,
+        nullable=False,
+        server_default=sa.text("1"),
+    )
+    updated_at: Mapped[sa.DateTime] = mapped_column(
+        dthelpers.TZDateTime,
+        nullable=False,
+        default=dthelpers.now,
+        onupdate=dthelpers.now,
+    )
 
     @property
     def safe_email(self) -> str:
@@ -48,35 +85,41 @@ class User(ModelBase):
 
     @staticmethod
     def hash_password(password: str, salt: str = None):
-        """ Hash a password with PBKDF2.
+        """ Hash a password with the configured scheme.
             If no salt is provided, a new one will be generated.
         """
-        if not salt:
-            salt = hashlib.sha256(os.urandom(60)).hexdigest().encode('ascii')
-
-        pwdhash = hashlib.pbkdf2_hmac(
-            'sha512',
-            password.encode('utf-8'),
-            salt,
-            100000
-        )
-        pwdhash = binascii.hexlify(pwdhash)
-        return (salt + pwdhash).decode('ascii')
+        return password_hasher.hash(password, salt)
     
     @staticmethod
     def verify_password(hashed_password, pt_password):
-        """ Compare a plaintext.
+        """ Compare a plaintext password against a stored hash in constant time.
+            Hashes of any registered scheme, and legacy hashes, are accepted.
+        """
+        return passwords.verify_password(hashed_password, pt_password)
+
+    @staticmethod
+    def needs_rehash(hashed_password: str) -> bool:
+        """ Check if a stored hash differs from the configured scheme.
+        """
+        return passwords.needs_rehash(hashed_password, password_hasher)
+
+    @staticmethod
+    async def hash_password_async(password: str, salt: str = None) -> str:
+        """ Hash a password on the bounded hashing pool.
+            Raises ServiceBusy when the pool is saturated.
         """
-        salt = hashed_password[:64]
-        hashed_password = hashed_password[64:]
-        pwdhash = hashlib.pbkdf2_hmac(
-            'sha512',
-            pt_password.encode('utf-8'),
-            salt.encode('ascii'),
-            100000
+        return await hash_executor.run(User.hash_password, password, salt)
+
+    @staticmethod
+    async def verify_password_async(hashed_password, pt_password) -> bool:
+        """ Verify a password on the bounded hashing pool.
+            Raises ServiceBusy when the pool is saturated.
+        """
+        return await hash_executor.run(
+            User.verify_password,
+            hashed_password,
+            pt_password,
         )
-        pwdhash = binascii.hexlify(pwdhash).decode('ascii')
-        return pwdhash == hashed_password
 
     @classmethod
     async def get_by_id(
@@ -84,16 +127,62 @@ class User(ModelBase):
         session: AsyncDatabaseConnection,
         user_id: int,
     ) -> User | None:
-        """ Get a user by their ID.
+        """ Get a user by their ID. Concurrent identical lookups share one
+            query.
         """
-        result = await session.execute(
-            sa.select(cls).where(cls.id == user_id)
-        )
-        return result.scalars().first()
+        async def load() -> User | None:
+            result = await session.execute(
+                sa.select(cls).where(cls.id == user_id)
+            )
+            return result.scalars().first()
+
+        return await cls.load_once(session, ("id", user_id), load)
+
+    @classmethod
+    async def get_version(
+        cls,
+        session: AsyncDatabaseConnection,
+        user_id: int,
+    ) -> sa.Row[tuple[int, datetime]] | None:
+        """ Get a user's (version, updated_at) without loading the row into
+            the session, or None if there is no such user. Concurrent
+            identical lookups share one query.
+        """
+        async def load() -> sa.Row | None:
+            result = await session.execute(
+                sa.select(cls.version, cls.updated_at).where(cls.id == user_id)
+            )
+            return result.first()
+
+        return await cls.load_once(session, ("version", user_id), load)
+
+    def mark_changed(self) -> None:
+        """ Bump the version in the pending UPDATE, so pages cached for the
+            old one are rendered again. It is incremented in SQL, so
+            concurrent changes each get their own version; the attribute
+            can't be read again until the user is refreshed.
+        """
+        self.version = User.version + 1
+
+    async def deactivate(self, session: AsyncDatabaseConnection) -> None:
+        """ Deactivate the user and revoke every session and token issued
+            to them, on every worker.
+        """
+        # Imported here as the session utilities import this module
+        from shavon.utilities.session import revoke_user
+
+        self.is_active = False
+        self.mark_changed()
+        session.add(self)
+        await session.flush()
+        await revoke_user(session, self.id)
 
 
 class LoginAttempt(ModelBase):
     __tablename__ = "login_attempts"
+    __table_args__ = (
+        sa.Index("idx_login_attempts_last_attempt", "last_attempt"),
+    )
 
     ip_address: Mapped[int] = mapped_column(
         sa.String(45),
@@ -112,33 +201,56 @@ class LoginAttempt(ModelBase):
     )
 
     @classmethod
-    async def get_attempt(
+    async def register_attempt(
         cls,
         session: AsyncDatabaseConnection,
-        ip_address: str, 
-    ) -> LoginAttempt:
-        """ Get or create a login attempt record for the given IP address.
+        ip_address: str,
+    ) -> int:
+        """ Atomically count a login attempt for the IP address and return the
+            new attempt count, using INSERT ... ON CONFLICT DO UPDATE ...
+            RETURNING so concurrent attempts can't lose increments.
         """
+        now = dthelpers.now()
+        insert = UPSERT_INSERTS[session.get_bind().dialect.name](cls)
+        statement = insert.values(
+            ip_address=ip_address,
+            attempt_count=1,
+            last_attempt=now,
+        ).on_conflict_do_update(
+            index_elements=[cls.ip_address],
+            set_={
+                "attempt_count": cls.attempt_count + 1,
+                "last_attempt": now,
+            },
+        ).returning(cls.attempt_count)
 
-        # Execute the query to retrieve an existing LoginAttempt
-        result = await session.execute(
-             sa.select(cls).where(cls.ip_address == ip_address)
-        )
-        record = result.scalars().first()
-
-        # If no record exists, create a new one
-        if record is None:
-            print(f"Creating new LoginAttempt for IP: {ip_address}")
-            record = cls(ip_address=ip_address, attempt_count=0)
-        else:
-            print(f"Found existing LoginAttempt for IP: {ip_address}, "
-                  f"Current attempts: {record.attempt_count}")
-        return record
-    
-    def increment(self) -> None:
-        """ Increment the attempt count and update the last attempt time.
+        result = await session.execute(statement)
+        return result.scalar_one()
+
+    @classmethod
+    async def clear(
+        cls,
+        session: AsyncDatabaseConnection,
+        ip_address: str,
+    ) -> None:
+        """ Remove the login attempt record for the IP address.
         """
-        self.attempt_count += 1
-        self.last_attempt = dthelpers.now()
-        
+        await session.execute(
+            sa.delete(cls).where(cls.ip_address == ip_address)
+        )
 
+    @classmethod
+    async def delete_stale(
+        cls,
+        session: AsyncDatabaseConnection,
+        attempted_before: datetime,
+        limit: int,
+    ) -> int:
+        """ Delete up to `limit` records last attempted before
+            `attempted_before`. Returns the number deleted.
+        """
+        return await cls.delete_batch(
+            session,
+            cls.last_attempt < attempted_before,
+            limit=limit,
+        )
@@ -1,24 +1,40 @@
 from __future__ import annotations
 
+import hashlib
+import secrets
+
+from datetime import datetime
+
 import sqlalchemy as sa
 from sqlalchemy.orm import (
+    load_only,
     mapped_column,
     Mapped,
     relationship,
 )
 
+from shavon import db
+from shavon import settings
 from shavon.models import ModelBase
-from shavon.utilities import random_alphanumeric
 from shavon.utilities import dthelpers
 from shavon.utilities.dbhelpers import AsyncDatabaseConnection
-from shavon.models.auth import User
+from shavon.utilities.writebehind import WriteBehindBuffer
+from shavon.models.auth import (
+    UPSERT_INSERTS,
+    AuthUser,
+    User,
+)
 
 
 class Session(ModelBase):
     __tablename__ = "sessions"
+    __table_args__ = (
+        sa.Index("idx_sessions_user_id", "user_id"),
+        sa.Index("idx_sessions_last_accessed", "last_accessed"),
+    )
 
     session_key: Mapped[str] = mapped_column(
-        sa.String(32),
+        sa.String(64),
         nullable=False,
         primary_key=True,
     )
@@ -46,6 +62,20 @@ class Session(ModelBase):
         nullable=True,
     )
 
+    # Only the SHA-256 of a session token is stored; the token itself is
+    # only ever held by the client's cookie
+    token = None
+
+    @staticmethod
+    def generate_key() -> str:
+        """Generate a new session token with 256 bits of entropy."""
+        return secrets.token_urlsafe(32)
+
+    @staticmethod
+    def hash_key(token: str) -> str:
+        """Return the stored form of a session token."""
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
     @classmethod
     async def create_session(
         cls,
@@ -54,36 +84,36 @@ class Session(ModelBase):
         ip_address: str = None,
         user_agent: str = None,
     ) -> Session:
-        """Create a new session for the user."""
-
-        # Session key must be unique
-        unique_session_key = None
-        found_unique_key = False
-
-        # Check until a unique session key is found
-        while not found_unique_key:
-            unique_session_key = random_alphanumeric(32)
-            statement = sa.select(
-                sa.func.count(cls.session_key)
-            ).where(
-                cls.session_key == unique_session_key
+        """Create a new session for the user with a single INSERT.
+        The raw token for the cookie is set on the returned session's `token`.
+        """
+        insert = UPSERT_INSERTS[session.get_bind().dialect.name]
+
+        # Collisions are practically impossible, so insert optimistically and
+        # only try another key if the insert was skipped as a duplicate
+        for _ in range(3):
+            token = cls.generate_key()
+            now = dthelpers.now()
+            values = dict(
+                session_key=cls.hash_key(token),
+                user_id=user_id,
+                created_at=now,
+                last_accessed=now,
+                ip_address=ip_address,
+                user_agent=user_agent,
+            )
+            result = await session.execute(
+                insert(cls)
+                .values(**values)
+                .on_conflict_do_nothing(index_elements=[cls.session_key])
+                .returning(cls.session_key)
             )
+            if result.first():
+                new_user_session = cls(**values)
+                new_user_session.token = token
+                return new_user_session
 
-            result = await session.execute(statement)
-            existing_count = result.scalar()
-            if existing_count == 0:
-                found_unique_key = True
-
-        # Create the new session
-        new_user_session = cls(
-            user_id=user_id,
-            session_key=unique_session_key,
-            ip_address=ip_address,
-            user_agent=user_agent,
-        )
-        session.add(new_user_session)
-        await session.flush()
-        return new_user_session
+        raise RuntimeError("Could not generate a unique session key")
 
     @classmethod
     async def get_by_user_and_key(
@@ -92,7 +122,9 @@ class Session(ModelBase):
         user_id: int,
         session_key: str,
     ) -> Session | None:
-        """Get a session by user_id and session_key."""
+        """Get a session by user_id and session_key. Never shared with
+        concurrent lookups, which could return it from before a logout.
+        """
         result = await session.execute(
             sa.select(cls).where(
                 sa.and_(
@@ -103,12 +135,223 @@ class Session(ModelBase):
         )
         return result.scalars().first()
 
-    async def update_last_accessed(
-        self,
+    @classmethod
+    async def get_with_user(
+        cls,
+        session: AsyncDatabaseConnection,
+        user_id: int,
+        session_key: str,
+    ) -> tuple[Session, AuthUser] | None:
+        """Validate a session and load its active user in one round-trip.
+        Only the session columns needed for auth are loaded; other
+        attributes are deferred. Returns None if the session doesn't exist
+        or the user is inactive. Like get_by_user_and_key, never shared
+        with concurrent lookups.
+        """
+        statement = (
+            sa.select(cls, User.id, User.email, User.is_active)
+            .join(User, User.id == cls.user_id)
+            .where(
+                cls.user_id == user_id,
+                cls.session_key == session_key,
+                User.is_active.is_(True),
+            )
+            .options(
+                load_only(cls.session_key, cls.user_id, cls.last_accessed),
+            )
+        )
+
+        result = await session.execute(statement)
+        row = result.first()
+        if not row:
+            return None
+        return row[0], AuthUser(*row[1:])
+
+    def mark_accessed(self) -> bool:
+        """Set last_accessed to now, unless it was set within the configured
+        granularity. Returns True if it was updated.
+        """
+        now = dthelpers.now()
+        elapsed = (now - self.last_accessed).total_seconds()
+        if elapsed < settings.SESSION_TOUCH_GRANULARITY:
+            return False
+
+        self.last_accessed = now
+        return True
+
+    def touch(self) -> None:
+        """Record an access to be written by the next batched flush.
+        Skipped if the session was touched within the configured granularity.
+        """
+        if self.mark_accessed():
+            last_accessed_writer.put(self.session_key, self.last_accessed)
+
+    @classmethod
+    async def delete_by_key(
+        cls,
+        session: AsyncDatabaseConnection,
+        session_key: str,
+    ) -> None:
+        """Delete a session by its key."""
+        await session.execute(
+            sa.delete(cls).where(cls.session_key == session_key)
+        )
+
+    @classmethod
+    async def delete_stale(
+        cls,
+        session: AsyncDatabaseConnection,
+        accessed_before: datetime,
+        limit: int,
+    ) -> int:
+        """Delete up to `limit` sessions last used before `accessed_before`.
+        Returns the number deleted.
+        """
+        return await cls.delete_batch(
+            session,
+            cls.last_accessed < accessed_before,
+            limit=limit,
+        )
+
+    @classmethod
+    async def bulk_update_last_accessed(
+        cls,
+        session: AsyncDatabaseConnection,
+        touches: dict[str, datetime],
+    ) -> None:
+        """Write many last_accessed timestamps with a single UPDATE ... FROM
+        (VALUES ...), or an executemany UPDATE on databases without it.
+        Timestamps never move backwards.
+        """
+        if session.get_bind().dialect.name != "postgresql":
+            table = cls.__table__
+            await session.execute(
+                sa.update(table)
+                .where(table.c.session_key == sa.bindparam("key"))
+                .where(table.c.last_accessed < sa.bindparam("accessed"))
+                .values(last_accessed=sa.bindparam("accessed")),
+                [
+                    {"key": key, "accessed": accessed}
+                    for key, accessed in touches.items()
+                ],
+            )
+            return
+
+        touched = sa.values(
+            sa.column("session_key", sa.String),
+            sa.column("last_accessed", dthelpers.TZDateTime),
+            name="touched",
+        ).data(list(touches.items()))
+
+        await session.execute(
+            sa.update(cls)
+            .where(cls.session_key == touched.c.session_key)
+            .where(cls.last_accessed < touched.c.last_accessed)
+            .values(last_accessed=touched.c.last_accessed)
+            .execution_options(synchronize_session=False)
+        )
+
+
+class Revocation(ModelBase):
+    __tablename__ = "revocations"
+    __table_args__ = (
+        sa.Index("idx_revocations_revoked_at", "revoked_at"),
+    )
+
+    id: Mapped[int] = mapped_column(
+        sa.Integer,
+        nullable=False,
+        primary_key=True,
+        autoincrement=True,
+    )
+    # Either a single session (by its stored key) or every session of a user
+    # issued before `revoked_at` is revoked
+    session_key: Mapped[str] = mapped_column(
+        sa.String(64),
+        nullable=True,
+    )
+    user_id: Mapped[int] = mapped_column(
+        sa.Integer,
+        nullable=True,
+    )
+    revoked_at: Mapped[sa.DateTime] = mapped_column(
+        dthelpers.TZDateTime,
+        nullable=False,
+        default=dthelpers.now,
+    )
+    # Once every token issued before the revocation has expired, the row is
+    # no longer needed
+    expires_at: Mapped[sa.DateTime] = mapped_column(
+        dthelpers.TZDateTime,
+        nullable=False,
+    )
+
+    @classmethod
+    async def create(
+        cls,
         session: AsyncDatabaseConnection,
+        entry: dict,
     ) -> None:
-        """Update the last_accessed timestamp."""
-        self.last_accessed = dthelpers.now()
-        session.add(self)
+        """Record a revocation entry, as built by StateStore.revocation_entry."""
+        session.add(cls(
+            session_key=entry["sid"],
+            user_id=entry["user_id"],
+            revoked_at=dthelpers.fromtimestamp(entry["revoked_at"]),
+            expires_at=dthelpers.fromtimestamp(entry["expires_at"]),
+        ))
         await session.flush()
 
+    @classmethod
+    async def get_since(
+        cls,
+        session: AsyncDatabaseConnection,
+        since: datetime | None = None,
+    ) -> list[dict]:
+        """Get the unexpired revocations made after `since`, as entries."""
+        statement = sa.select(
+            cls.session_key,
+            cls.user_id,
+            cls.revoked_at,
+            cls.expires_at,
+        ).where(cls.expires_at > dthelpers.now())
+        if since is not None:
+            statement = statement.where(cls.revoked_at > since)
+
+        result = await session.execute(statement.order_by(cls.revoked_at))
+        return [
+            {
+                "sid": row.session_key,
+                "user_id": row.user_id,
+                "revoked_at": row.revoked_at.timestamp(),
+                "expires_at": row.expires_at.timestamp(),
+            }
+            for row in result
+        ]
+
+    @classmethod
+    async def delete_expired(
+        cls,
+        session: AsyncDatabaseConnection,
+        limit: int,
+    ) -> int:
+        """Delete up to `limit` expired revocations. Returns the number deleted."""
+        return await cls.delete_batch(
+            session,
+            cls.expires_at <= dthelpers.now(),
+            limit=limit,
+        )
+
+
+async def _flush_last_accessed(touches: dict[str, datetime]) -> None:
+    async with db.session() as session:
+        await Session.bulk_update_last_accessed(session, touches)
+        await session.commit()
+
+
+# Pending last_accessed writes, flushed by a per-worker background task
+last_accessed_writer = WriteBehindBuffer(
+    flush=_flush_last_accessed,
+    interval=settings.SESSION_TOUCH_INTERVAL,
+    name="session-last-accessed",
+)
+
@@ -0,0 +1,129 @@
+""" Deletes stale rows from the sessions, login_attempts and revocations tables.
+
+Runs next to the server every REAPER_INTERVAL seconds, or on demand:
+
+    python -m shavon.reaper
+    python -m shavon.reaper --loop --interval 300
+"""
+import argparse
+import asyncio
+import logging
+
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from shavon import db
+from shavon import settings
+from shavon.models.auth import LoginAttempt
+from shavon.models.session import (
+    Revocation,
+    Session,
+)
+from shavon.utilities import dthelpers
+from shavon.utilities.dbhelpers import AsyncDatabaseConnection
+from shavon.utilities.logs import configure_logging
+
+
+logger = logging.getLogger(__name__)
+
+
+def _targets(
+    now: datetime,
+) -> dict[str, Callable[[AsyncSession, int], Awaitable[int]]]:
+    """ Batch delete functions for each table, with cutoffs as of `now`.
+    """
+    sessions_before = now - timedelta(seconds=settings.SESSION_RETENTION)
+    attempts_before = now - timedelta(seconds=settings.LOGIN_ATTEMPT_WINDOW)
+    return {
+        "sessions": lambda session, limit: Session.delete_stale(
+            session, accessed_before=sessions_before, limit=limit,
+        ),
+        "login_attempts": lambda session, limit: LoginAttempt.delete_stale(
+            session, attempted_before=attempts_before, limit=limit,
+        ),
+        "revocations": lambda session, limit: Revocation.delete_expired(
+            session, limit=limit,
+        ),
+    }
+
+
+async def reap(
+    database: AsyncDatabaseConnection,
+    batch_size: int = settings.REAPER_BATCH_SIZE,
+    max_batches: int = settings.REAPER_MAX_BATCHES,
+) -> dict[str, int]:
+    """ Delete stale rows, committing after each batch so locks are held
+        briefly. Returns the number of rows deleted per table.
+    """
+    reaped = {}
+    for table, delete in _targets(dthelpers.now()).items():
+        reaped[table] = 0
+        for _ in range(max_batches):
+            async with database.session() as session:
+                deleted = await delete(session, batch_size)
+                await session.commit()
+
+            reaped[table] += deleted
+            if deleted < batch_size:
+                break
+
+    logger.info("Reaped stale rows", extra=reaped)
+    return reaped
+
+
+async def reap_forever(
+    database: AsyncDatabaseConnection,
+    interval: float,
+    batch_size: int = settings.REAPER_BATCH_SIZE,
+    max_batches: int = settings.REAPER_MAX_BATCHES,
+) -> None:
+    """ Reap every `interval` seconds until cancelled.
+    """
+    while True:
+        try:
+            await reap(database, batch_size, max_batches)
+        except Exception:
+            logger.exception("Reaper run failed")
+        await asyncio.sleep(interval)
+
+
+def run_reaper(interval: float) -> None:
+    """ Process entry point for `reap_forever` on the configured database.
+    """
+    configure_logging(settings.LOG_LEVEL, settings.LOG_FORMAT)
+    asyncio.run(reap_forever(db, interval))
+
+
+def main(argv: list[str] | None = None) -> dict[str, int]:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=settings.REAPER_BATCH_SIZE)
+    parser.add_argument("--max-batches", type=int, default=settings.REAPER_MAX_BATCHES)
+    parser.add_argument("--loop", action="store_true", help="Keep reaping")
+    parser.add_argument("--interval", type=float, default=settings.REAPER_INTERVAL)
+    args = parser.parse_args(argv)
+
+    configure_logging(settings.LOG_LEVEL, settings.LOG_FORMAT)
+
+    async def run() -> dict[str, int]:
+        try:
+            if args.loop:
+                await reap_forever(
+                    db,
+                    args.interval,
+                    args.batch_size,
+                    args.max_batches,
+                )
+            return await reap(db, args.batch_size, args.max_batches)
+        finally:
+            await db.dispose()
+
+    reaped = asyncio.run(run())
+    for table, count in reaped.items():
+        print(f"{table:<16}{count:>10}")
+    return reaped
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,10 @@
 from dotenv import load_dotenv
 import os
+import tempfile
 
-# Load environment variables from .env file
-load_dotenv(override=True)
-
-# Import blueprints
-from shavon.blueprints import BLUEPRINTS_ENABLED
+# Load environment variables from .env file. Variables already set in the
+# environment win, so a process manager or one-off command can override it
+load_dotenv(override=False)
 
 # Application settings
 APP_NAME = os.getenv("APP_NAME", "Shavon")
@@ -13,6 +12,65 @@ APP_VERSION = os.getenv("APP_VERSION", "1.0.0")
 APP_HOST = os.getenv("APP_HOST", "localhost")
 APP_PORT = int(os.getenv("APP_PORT", 8000))
 APP_DEBUG = os.getenv("APP_DEBUG", "false").lower() == "true"
+# Directory of the shavon package, for paths that shouldn't depend on the CWD
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_PATH = os.getenv("STATIC_PATH", os.path.join(PACKAGE_DIR, "static"))
+# Files shared between the server's processes go in a directory only this
+# user can use: the session's runtime directory, or a private one under the
+# temp directory
+RUNTIME_DIR = os.getenv("XDG_RUNTIME_DIR") or os.path.join(
+    tempfile.gettempdir(), f"shavon-{os.getuid()}"
+)
+
+# Fingerprinted, compressed copies of STATIC_PATH, served at STATIC_URL. They
+# are rebuilt when the server starts unless STATIC_BUILD_ON_START is false,
+# e.g. when `python -m shavon.utilities.assets` runs at deploy time instead
+STATIC_URL = os.getenv("STATIC_URL", "/static")
+STATIC_BUILD_PATH = os.getenv(
+    "STATIC_BUILD_PATH", os.path.join(PACKAGE_DIR, "build", "static")
+)
+STATIC_BUILD_ON_START = os.getenv(
+    "STATIC_BUILD_ON_START", "true"
+).lower() == "true"
+# Cache-Control max-age of assets requested without their fingerprint
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", 300))
+
+# Server tuning for `python -m shavon.launch`. APP_WORKERS is a number of
+# worker processes or "auto" for one per CPU core
+APP_WORKERS = os.getenv("APP_WORKERS", "1")
+APP_USE_UVLOOP = os.getenv("APP_USE_UVLOOP", "true").lower() == "true"
+APP_ACCESS_LOG = os.getenv("APP_ACCESS_LOG", "false").lower() == "true"
+APP_BACKLOG = int(os.getenv("APP_BACKLOG", 1024))
+APP_KEEP_ALIVE = os.getenv("APP_KEEP_ALIVE", "true").lower() == "true"
+# Keep above the idle timeout of any proxy in front, so it closes first
+APP_KEEP_ALIVE_TIMEOUT = float(os.getenv("APP_KEEP_ALIVE_TIMEOUT", 75))
+# Seconds in-flight requests get to finish on shutdown
+APP_GRACEFUL_SHUTDOWN_TIMEOUT = float(
+    os.getenv("APP_GRACEFUL_SHUTDOWN_TIMEOUT", 15)
+)
+
+# Logging for the shavon loggers; LOG_FORMAT is text (key=value) or json
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+
+# Request metrics, off by default, served in Prometheus format at /_metrics
+# to the comma separated METRICS_ALLOWED_IPS (empty allows anyone). Behind a
+# reverse proxy every client has the proxy's address, so set METRICS_TOKEN
+# too; scrapers then send it as "Authorization: Bearer <token>". Each worker
+# writes its metrics to METRICS_DIR every METRICS_INTERVAL seconds for
+# aggregation; it must be private to this user, as the socket's is below
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() == "true"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+METRICS_DIR = os.getenv(
+    "METRICS_DIR",
+    os.path.join(RUNTIME_DIR, "shavon-metrics"),
+)
+METRICS_INTERVAL = float(os.getenv("METRICS_INTERVAL", 5))
+METRICS_ALLOWED_IPS = [
+    ip.strip()
+    for ip in os.getenv("METRICS_ALLOWED_IPS", "127.0.0.1,::1").split(",")
+    if ip.strip()
+]
 
 # Database configuration
 DB_HOST = os.getenv("DB_HOST", "localhost")
@@ -24,13 +82,53 @@ DB_NAME = os.getenv("DB_NAME", "default_db")
 # SQLAlchemy settings
 SQL_ECHO = os.getenv("SQL_ECHO", "false").lower() == "true"
 DB_DRIVER = "postgresql+asyncpg"
-DB_CONNECT_URL = f"{DB_DRIVER}://{DB_USER}:{DB_PASSWORD}" \
+DB_CONNECT_URL = os.getenv("DB_CONNECT_URL") \
+                or f"{DB_DRIVER}://{DB_USER}:{DB_PASSWORD}" \
                 + f"@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# Comma separated connection URLs of read replicas
+DB_REPLICA_URLS = [
+    url.strip()
+    for url in os.getenv("DB_REPLICA_URLS", "").split(",")
+    if url.strip()
+]
+DB_REPLICA_EJECT_SECONDS = float(os.getenv("DB_REPLICA_EJECT_SECONDS", 30))
 DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
 DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "false").lower() == "true"
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))  # seconds, -1 never
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))  # seconds
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", 0))  # seconds, 0 off
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", 0))  # ms, 0 off
 
 # Template settings
-TEMPLATE_PATH = os.getenv("TEMPLATE_PATH", "./shavon/templates")
+TEMPLATE_PATH = os.getenv(
+    "TEMPLATE_PATH", os.path.join(PACKAGE_DIR, "templates")
+)
+TEMPLATE_CACHE_SIZE = int(os.getenv("TEMPLATE_CACHE_SIZE", 400))
+TEMPLATE_AUTO_RELOAD = os.getenv(
+    "TEMPLATE_AUTO_RELOAD", str(APP_DEBUG)
+).lower() == "true"
+TEMPLATE_BYTECODE_CACHE = os.getenv(
+    "TEMPLATE_BYTECODE_CACHE", "true"
+).lower() == "true"
+# Empty path uses a per-user directory in the system temp folder
+TEMPLATE_BYTECODE_CACHE_PATH = os.getenv("TEMPLATE_BYTECODE_CACHE_PATH", "")
+
+# Concurrent identical model lookups share one query, see ModelBase.load_once
+SINGLE_FLIGHT_ENABLED = os.getenv(
+    "SINGLE_FLIGHT_ENABLED", "true"
+).lower() == "true"
+
+# Rendered anonymous pages kept per worker, see utilities.pagecache. Off in
+# debug so template edits show up
+PAGE_CACHE_ENABLED = os.getenv(
+    "PAGE_CACHE_ENABLED", str(not APP_DEBUG)
+).lower() == "true"
+PAGE_CACHE_SIZE = int(os.getenv("PAGE_CACHE_SIZE", 500))
+PAGE_CACHE_TTL = float(os.getenv("PAGE_CACHE_TTL", 60))  # seconds
+# Pages cached by record version never go stale, so they can be kept longer
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", 3600))  # seconds
 
 # Cookie configurations
 AUTH_COOKIE_NAME = os.getenv("AUTH_COOKIE_NAME", "auth_token")
@@ -38,6 +136,78 @@ AUTH_COOKIE_DOMAIN = os.getenv("AUTH_COOKIE_DOMAIN", "localhost")
 AUTH_COOKIE_LIFESPAN = int(os.getenv("AUTH_COOKIE_LIFESPAN", 3600))  # seconds
 AUTH_COOKIE_SECRET_KEY = os.getenv("AUTH_COOKIE_SECRET_KEY")
 AUTH_COOKIE_ALGORITHM = os.getenv("AUTH_COOKIE_ALGORITHM", "HS256")
+# Rotating signing keys as `kid=secret,...`; the first signs new tokens and
+# the rest, with AUTH_COOKIE_SECRET_KEY for tokens without a kid, only verify
+AUTH_COOKIE_SECRET_KEYS = os.getenv("AUTH_COOKIE_SECRET_KEYS", "")
+
+# Per-worker cache of verified token payloads, keyed by token digest
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", 10000))
+AUTH_TOKEN_CACHE_TTL = float(os.getenv("AUTH_TOKEN_CACHE_TTL", 300))  # seconds
+
+# Stateless auth: tokens carry sid/iat/exp/active claims and are accepted
+# without a session lookup until they are within REFRESH_WINDOW seconds of
+# `exp`, when the session is checked once and a new token issued. Sessions
+# revoked by any worker, stateless or not, are read every REVOCATION_INTERVAL
+# seconds; a worker whose list is older than REVOCATION_MAX_AGE checks every
+# session instead, skipping both stateless tokens and the auth cache
+AUTH_STATELESS = os.getenv("AUTH_STATELESS", "false").lower() == "true"
+AUTH_TOKEN_LIFESPAN = int(os.getenv("AUTH_TOKEN_LIFESPAN", 900))  # seconds
+AUTH_TOKEN_REFRESH_WINDOW = int(os.getenv("AUTH_TOKEN_REFRESH_WINDOW", 300))
+AUTH_REVOCATION_INTERVAL = float(os.getenv("AUTH_REVOCATION_INTERVAL", 5))
+AUTH_REVOCATION_MAX_AGE = float(os.getenv("AUTH_REVOCATION_MAX_AGE", 60))
+
+# Per-worker cache of validated sessions used by auth_required. Sessions
+# revoked on another worker drop out within AUTH_REVOCATION_INTERVAL
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", 10000))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", 30))  # seconds
+
+# Session.last_accessed is written in batches every INTERVAL seconds, and a
+# session is only touched again once GRANULARITY seconds have passed
+SESSION_TOUCH_INTERVAL = float(os.getenv("SESSION_TOUCH_INTERVAL", 10))
+SESSION_TOUCH_GRANULARITY = float(os.getenv("SESSION_TOUCH_GRANULARITY", 60))
+
+# Stale rows are deleted from the sessions, login_attempts and revocations
+# tables every REAPER_INTERVAL seconds (0 runs no reaper alongside the server;
+# use `python -m shavon.reaper` instead), in transactions of BATCH_SIZE rows
+# and at most MAX_BATCHES per table per run. Sessions unused for
+# SESSION_RETENTION seconds are stale; login attempts after
+# LOGIN_ATTEMPT_WINDOW
+REAPER_INTERVAL = float(os.getenv("REAPER_INTERVAL", 900))
+REAPER_BATCH_SIZE = int(os.getenv("REAPER_BATCH_SIZE", 1000))
+REAPER_MAX_BATCHES = int(os.getenv("REAPER_MAX_BATCHES", 100))
+
+# Where sessions and login attempts live: postgres, memory (one worker only)
+# or socket (a store process shared by the workers on this host)
+STATE_STORE = os.getenv("STATE_STORE", "postgres")
+# The socket's directory must be private to this user
+STATE_STORE_SOCKET = os.getenv(
+    "STATE_STORE_SOCKET", os.path.join(RUNTIME_DIR, "shavon-state.sock")
+)
+# Start the socket store alongside the workers, rather than run it separately
+STATE_STORE_SERVE = os.getenv("STATE_STORE_SERVE", "true").lower() == "true"
+# Seconds a login attempt counter is kept after the last attempt
+LOGIN_ATTEMPT_WINDOW = int(os.getenv("LOGIN_ATTEMPT_WINDOW", 3600))
+# Attempts from one IP within the window before a captcha is required
+LOGIN_CAPTCHA_AFTER = int(os.getenv("LOGIN_CAPTCHA_AFTER", 3))
+# Seconds after its last use that a session row is kept. Defaults to the
+# cookie lifespan, after which the session can't be presented any more
+SESSION_RETENTION = int(os.getenv("SESSION_RETENTION", AUTH_COOKIE_LIFESPAN))
+
+# Per-worker login rate limit, per client IP. RATE is tokens per second and
+# 0 disables the limiter; BURST is the bucket size
+LOGIN_RATE_LIMIT = float(os.getenv("LOGIN_RATE_LIMIT", 0.5))
+LOGIN_RATE_BURST = int(os.getenv("LOGIN_RATE_BURST", 10))
+
+# Password hashing scheme for new hashes. Stored hashes that don't match are
+# rehashed on the next successful login. PARAMS is `k=v,...`, e.g. `i=100000`
+PASSWORD_HASH_SCHEME = os.getenv("PASSWORD_HASH_SCHEME", "pbkdf2-sha512")
+PASSWORD_HASH_PARAMS = os.getenv("PASSWORD_HASH_PARAMS", "i=100000")
+
+# Password hashing pool (keeps PBKDF2 off the event loop)
+PASSWORD_HASH_WORKERS = int(
+    os.getenv("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1))
+)
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", 32))
 
 # Safe Settings (These are exposed to the jinja environment)
 SAFE_SETTINGS = {
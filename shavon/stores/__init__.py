@@ -0,0 +1,20 @@
+from shavon.stores.base import (
+    KeyValueStateStore,
+    StateStore,
+)
+from shavon.stores.local_socket import LocalSocketStateStore
+from shavon.stores.memory import MemoryStateStore
+from shavon.stores.postgres import PostgresStateStore
+
+
+def build_state_store(backend: str, socket_path: str = None) -> StateStore:
+    """ Build the state store named by STATE_STORE: postgres, memory or
+        socket.
+    """
+    if backend == "postgres":
+        return PostgresStateStore()
+    if backend == "memory":
+        return MemoryStateStore()
+    if backend == "socket":
+        return LocalSocketStateStore(socket_path)
+    raise ValueError(f"Unknown state store: {backend}")
@@ -0,0 +1,310 @@
+from __future__ import annotations
+
+import time
+
+from abc import ABC, abstractmethod
+from typing import Any
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from shavon import settings
+from shavon.models.auth import (
+    AuthUser,
+    User,
+)
+from shavon.models.session import Session
+from shavon.utilities import dthelpers
+
+
+class StateStore(ABC):
+    """ Storage for hot, short-lived auth state: sessions and login attempts.
+
+        Every method takes the request's database session so that the
+        Postgres store can share its transaction; other stores ignore it,
+        except where they need to load the User. Session keys passed in are
+        the stored (hashed) form, see Session.hash_key.
+    """
+
+    @abstractmethod
+    async def create_session(
+        self,
+        session: AsyncSession,
+        user_id: int,
+        ip_address: str = None,
+        user_agent: str = None,
+    ) -> Session:
+        ...
+
+    @abstractmethod
+    async def get_session(
+        self,
+        session: AsyncSession,
+        user_id: int,
+        session_key: str,
+    ) -> Session | None:
+        ...
+
+    async def load_auth(
+        self,
+        session: AsyncSession,
+        user_id: int,
+        session_key: str,
+    ) -> tuple[Session, AuthUser] | None:
+        """ Load a session and its active user.
+            Returns None if either is missing or the user is inactive.
+        """
+        user_session = await self.get_session(session, user_id, session_key)
+        if not user_session:
+            return None
+
+        user = await User.get_by_id(session=session, user_id=user_id)
+        if not user or not user.is_active:
+            return None
+
+        return user_session, AuthUser.from_user(user)
+
+    @abstractmethod
+    async def touch(self, user_session: Session) -> None:
+        """ Record that a session was used.
+        """
+
+    @abstractmethod
+    async def delete_session(
+        self,
+        session: AsyncSession,
+        user_session: Session,
+    ) -> None:
+        ...
+
+    @staticmethod
+    def revocation_entry(
+        sid: str | None = None,
+        user_id: int | None = None,
+    ) -> dict[str, Any]:
+        """ Build a revocation entry for a session, or for every session of a
+            user issued until now. It is kept for as long as tokens issued,
+            or sessions cached, before it can be accepted without a session
+            lookup.
+        """
+        now = time.time()
+        return {
+            "sid": sid,
+            "user_id": user_id,
+            "revoked_at": now,
+            "expires_at": now + max(
+                settings.AUTH_TOKEN_LIFESPAN,
+                settings.AUTH_CACHE_TTL,
+            ),
+        }
+
+    @abstractmethod
+    async def revoke(
+        self,
+        session: AsyncSession,
+        entry: dict[str, Any],
+    ) -> None:
+        """ Publish a revocation entry to every worker's revocation list.
+        """
+
+    @abstractmethod
+    async def revocations_since(
+        self,
+        session: AsyncSession,
+        cursor: Any = None,
+    ) -> tuple[list[dict[str, Any]], Any]:
+        """ Return the revocation entries published after `cursor`, and the
+            cursor to pass on the next call. A None cursor returns every
+            unexpired entry. Entries may be returned more than once.
+        """
+
+    @abstractmethod
+    async def register_attempt(
+        self,
+        session: AsyncSession,
+        ip_address: str,
+    ) -> int:
+        """ Count a login attempt and return the attempt count for the IP.
+            The count must stand however the login ends, so it isn't left
+            to `session`'s transaction.
+        """
+
+    @abstractmethod
+    async def clear_attempts(
+        self,
+        session: AsyncSession,
+        ip_address: str,
+    ) -> None:
+        ...
+
+
+class KeyValueStateStore(StateStore):
+    """ StateStore on top of a key/value backend with native TTL expiry.
+        Sessions expire AUTH_COOKIE_LIFESPAN seconds after they're created,
+        together with their cookie. Login attempt counters expire
+        LOGIN_ATTEMPT_WINDOW seconds after the last attempt.
+
+        Subclasses implement the `_get`, `_add`, `_replace`, `_delete`,
+        `_incr`, `_push`, `_since` and `_epoch` primitives.
+    """
+
+    @abstractmethod
+    async def _get(self, key: str) -> Any:
+        ...
+
+    @abstractmethod
+    async def _add(self, key: str, value: Any, ttl: float | None = None) -> bool:
+        """ Set a key only if it doesn't exist. Returns True if it was set.
+        """
+
+    @abstractmethod
+    async def _replace(self, key: str, value: Any) -> bool:
+        """ Update an existing key, keeping its expiry. Returns False if the
+            key doesn't exist.
+        """
+
+    @abstractmethod
+    async def _delete(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    async def _incr(self, key: str, ttl: float | None = None) -> int:
+        """ Increment a counter, resetting its expiry to `ttl`.
+        """
+
+    @abstractmethod
+    async def _push(self, key: str, value: Any, ttl: float | None = None) -> int:
+        """ Append a value, which expires after `ttl`, to the log at `key`.
+            Returns the log's position after the value.
+        """
+
+    @abstractmethod
+    async def _since(self, key: str, position: int) -> tuple[int, list[Any]]:
+        """ Return the log's current position and its unexpired values
+            appended after `position`.
+        """
+
+    @abstractmethod
+    async def _epoch(self) -> str:
+        """ Return an identifier of the backend's current instance. Log
+            positions start over when it changes, e.g. on a restart.
+        """
+
+    @staticmethod
+    def _session_to_data(user_session: Session) -> dict[str, Any]:
+        return {
+            "session_key": user_session.session_key,
+            "user_id": user_session.user_id,
+            "created_at": user_session.created_at.timestamp(),
+            "last_accessed": user_session.last_accessed.timestamp(),
+            "ip_address": user_session.ip_address,
+            "user_agent": user_session.user_agent,
+        }
+
+    @staticmethod
+    def _session_from_data(data: dict[str, Any]) -> Session:
+        return Session(
+            session_key=data["session_key"],
+            user_id=data["user_id"],
+            created_at=dthelpers.fromtimestamp(data["created_at"]),
+            last_accessed=dthelpers.fromtimestamp(data["last_accessed"]),
+            ip_address=data["ip_address"],
+            user_agent=data["user_agent"],
+        )
+
+    async def create_session(
+        self,
+        session: AsyncSession,
+        user_id: int,
+        ip_address: str = None,
+        user_agent: str = None,
+    ) -> Session:
+        now = dthelpers.now()
+        while True:
+            token = Session.generate_key()
+            user_session = Session(
+                session_key=Session.hash_key(token),
+                user_id=user_id,
+                created_at=now,
+                last_accessed=now,
+                ip_address=ip_address,
+                user_agent=user_agent,
+            )
+            if await self._add(
+                f"session:{user_session.session_key}",
+                self._session_to_data(user_session),
+                ttl=settings.AUTH_COOKIE_LIFESPAN,
+            ):
+                user_session.token = token
+                return user_session
+
+    async def get_session(
+        self,
+        session: AsyncSession,
+        user_id: int,
+        session_key: str,
+    ) -> Session | None:
+        data = await self._get(f"session:{session_key}")
+        if not data or data["user_id"] != user_id:
+            return None
+        return self._session_from_data(data)
+
+    async def touch(self, user_session: Session) -> None:
+        if user_session.mark_accessed():
+            await self._replace(
+                f"session:{user_session.session_key}",
+                self._session_to_data(user_session),
+            )
+
+    async def delete_session(
+        self,
+        session: AsyncSession,
+        user_session: Session,
+    ) -> None:
+        await self._delete(f"session:{user_session.session_key}")
+
+    async def register_attempt(
+        self,
+        session: AsyncSession,
+        ip_address: str,
+    ) -> int:
+        return await self._incr(
+            f"attempts:{ip_address}",
+            ttl=settings.LOGIN_ATTEMPT_WINDOW,
+        )
+
+    async def clear_attempts(
+        self,
+        session: AsyncSession,
+        ip_address: str,
+    ) -> None:
+        await self._delete(f"attempts:{ip_address}")
+
+    async def revoke(
+        self,
+        session: AsyncSession,
+        entry: dict[str, Any],
+    ) -> None:
+        await self._push(
+            "revocations",
+            entry,
+            ttl=entry["expires_at"] - entry["revoked_at"],
+        )
+
+    async def revocations_since(
+        self,
+        session: AsyncSession,
+        cursor: tuple[str, int] | None = None,
+    ) -> tuple[list[dict[str, Any]], tuple[str, int]]:
+        # The cursor is a log position and the epoch it belongs to. Read
+        # the epoch first: should the backend restart before the log is
+        # read, the next call sees a new epoch and reads everything again
+        epoch = await self._epoch()
+        cursor_epoch, position = cursor or (epoch, 0)
+        if cursor_epoch != epoch:
+            position = 0
+
+        current, entries = await self._since("revocations", position)
+        if current < position:
+            # A log that went backwards started over; read all of it
+            current, entries = await self._since("revocations", 0)
+        return entries, (epoch, current)
@@ -0,0 +1,191 @@
+""" State store shared by every worker on a host through a unix socket.
+
+One process runs `serve()`, holding the state in a MemoryKV. Workers talk
+to it with LocalSocketStateStore over newline-delimited JSON, on a socket
+only the user running them can connect to:
+
+    -> {"op": "incr", "args": ["attempts:127.0.0.1", 3600]}
+    <- {"result": 1}
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import stat
+
+from typing import Any
+
+from shavon.stores.base import KeyValueStateStore
+from shavon.stores.memory import MemoryKV
+from shavon.utilities.fshelpers import check_owned, private_directory
+
+
+logger = logging.getLogger(__name__)
+
+# MemoryKV methods the server will run
+OPERATIONS = (
+    "get", "add", "replace", "delete", "incr", "push", "since", "epoch",
+)
+
+
+def _listen(path: str) -> socket.socket:
+    """ Bind a listening socket at `path` that only this user can connect
+        to. Its directory is created private if missing, and must not be
+        open to other users. A stale socket of ours is replaced; anything
+        else at `path` is left alone and an error raised.
+    """
+    private_directory(os.path.dirname(os.path.abspath(path)))
+
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        pass
+    else:
+        check_owned(path, st)
+        if not stat.S_ISSOCK(st.st_mode):
+            raise FileExistsError(f"{path} exists and isn't a socket")
+        os.unlink(path)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # Created without group or other permissions, so there is no window in
+    # which another user could connect
+    umask = os.umask(0o177)
+    try:
+        sock.bind(path)
+    except BaseException:
+        sock.close()
+        raise
+    finally:
+        os.umask(umask)
+    os.chmod(path, 0o600)
+    sock.listen(socket.SOMAXCONN)
+    return sock
+
+
+async def serve(path: str) -> None:
+    """ Serve a MemoryKV on a unix socket at `path` until cancelled.
+    """
+    kv = MemoryKV()
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    if request["op"] not in OPERATIONS:
+                        raise ValueError(f"Unknown operation: {request['op']}")
+                    result = getattr(kv, request["op"])(*request["args"])
+                    reply = {"result": result}
+                except Exception as err:
+                    reply = {"error": str(err)}
+
+                writer.write(json.dumps(reply).encode("utf-8") + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_unix_server(handle, sock=_listen(path))
+    logger.info("State store listening on %s", path)
+    async with server:
+        await server.serve_forever()
+
+
+def run_server(path: str) -> None:
+    """ Process entry point for `serve`.
+    """
+    asyncio.run(serve(path))
+
+
+class LocalSocketStateStore(KeyValueStateStore):
+    """ State store client for a `serve()` process on the same host.
+        Requests from one worker are sent one at a time over a single
+        connection, which is reopened after a failure.
+    """
+
+    def __init__(self, path: str, connect_retries: int = 20):
+        self.path = path
+        self.connect_retries = connect_retries
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._lock: asyncio.Lock | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    async def _connect(self) -> None:
+        # The server may still be starting when the first worker is ready
+        for attempt in range(self.connect_retries):
+            try:
+                self._reader, self._writer = await asyncio.open_unix_connection(
+                    self.path
+                )
+                return
+            except (FileNotFoundError, ConnectionRefusedError):
+                if attempt == self.connect_retries - 1:
+                    raise
+                await asyncio.sleep(0.1)
+
+    async def _disconnect(self) -> None:
+        writer, self._reader, self._writer = self._writer, None, None
+        if writer is not None:
+            writer.close()
+
+    async def _call(self, op: str, *args: Any) -> Any:
+        # Connections and locks belong to the loop that created them
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._lock = asyncio.Lock()
+            self._reader = self._writer = None
+
+        async with self._lock:
+            if self._writer is None or self._writer.is_closing():
+                await self._connect()
+
+            try:
+                request = {"op": op, "args": args}
+                self._writer.write(json.dumps(request).encode("utf-8") + b"\n")
+                await self._writer.drain()
+                line = await self._reader.readline()
+            except BaseException:
+                # Includes cancellation: a reply may still be in flight, so
+                # the connection can't be reused
+                await self._disconnect()
+                raise
+
+            if not line:
+                await self._disconnect()
+                raise ConnectionError("State store closed the connection")
+
+        reply = json.loads(line)
+        if "error" in reply:
+            raise RuntimeError(f"State store error: {reply['error']}")
+        return reply["result"]
+
+    async def _get(self, key: str) -> Any:
+        return await self._call("get", key)
+
+    async def _add(self, key: str, value: Any, ttl: float | None = None) -> bool:
+        return await self._call("add", key, value, ttl)
+
+    async def _replace(self, key: str, value: Any) -> bool:
+        return await self._call("replace", key, value)
+
+    async def _delete(self, key: str) -> None:
+        await self._call("delete", key)
+
+    async def _incr(self, key: str, ttl: float | None = None) -> int:
+        return await self._call("incr", key, ttl)
+
+    async def _push(self, key: str, value: Any, ttl: float | None = None) -> int:
+        return await self._call("push", key, value, ttl)
+
+    async def _since(self, key: str, position: int) -> tuple[int, list[Any]]:
+        return await self._call("since", key, position)
+
+    async def _epoch(self) -> str:
+        return await self._call("epoch")
+
+    async def close(self) -> None:
+        await self._disconnect()
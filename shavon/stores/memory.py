@@ -0,0 +1,153 @@
+import time
+import uuid
+
+from collections import deque
+from typing import Any
+
+from shavon.stores.base import KeyValueStateStore
+
+
+class MemoryKV:
+    """ Dictionary with per-key expiry. Expired keys are dropped when read,
+        and swept in bulk every `sweep_every` writes.
+
+        Append-only logs live in a separate namespace. Positions in a log
+        count every value ever appended, so they stay valid as expired
+        values are dropped from its head. They start over in a new MemoryKV,
+        which has a new `epoch`.
+    """
+
+    def __init__(self, sweep_every: int = 1000):
+        self._epoch = uuid.uuid4().hex
+        self._data: dict[str, tuple[float | None, Any]] = {}
+        self._logs: dict[str, tuple[list[int], deque]] = {}
+        self._writes = 0
+        self.sweep_every = sweep_every
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @staticmethod
+    def _expiry(ttl: float | None) -> float | None:
+        return None if ttl is None else time.monotonic() + ttl
+
+    def _live(self, key: str) -> tuple[float | None, Any] | None:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+
+        expires_at = entry[0]
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        return entry
+
+    def _written(self) -> None:
+        self._writes += 1
+        if self._writes >= self.sweep_every:
+            self._writes = 0
+            self.sweep()
+
+    def sweep(self) -> int:
+        """ Drop every expired key. Returns the number dropped.
+        """
+        now = time.monotonic()
+        expired = [
+            key for key, (expires_at, _) in self._data.items()
+            if expires_at is not None and expires_at <= now
+        ]
+        for key in expired:
+            del self._data[key]
+        return len(expired)
+
+    def get(self, key: str) -> Any:
+        entry = self._live(key)
+        return None if entry is None else entry[1]
+
+    def add(self, key: str, value: Any, ttl: float | None = None) -> bool:
+        if self._live(key) is not None:
+            return False
+        self._data[key] = (self._expiry(ttl), value)
+        self._written()
+        return True
+
+    def replace(self, key: str, value: Any) -> bool:
+        entry = self._live(key)
+        if entry is None:
+            return False
+        self._data[key] = (entry[0], value)
+        return True
+
+    def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    def incr(self, key: str, ttl: float | None = None) -> int:
+        entry = self._live(key)
+        value = 1 if entry is None else entry[1] + 1
+        self._data[key] = (self._expiry(ttl), value)
+        self._written()
+        return value
+
+    def epoch(self) -> str:
+        """ Identify this instance, so positions read from an earlier one
+            aren't taken for positions in its logs.
+        """
+        return self._epoch
+
+    def _log(self, key: str) -> tuple[list[int], deque]:
+        offset, items = self._logs.setdefault(key, ([0], deque()))
+
+        # Values are appended with the same ttl, so they expire in order
+        now = time.monotonic()
+        while items and items[0][0] is not None and items[0][0] <= now:
+            items.popleft()
+            offset[0] += 1
+        return offset, items
+
+    def push(self, key: str, value: Any, ttl: float | None = None) -> int:
+        offset, items = self._log(key)
+        items.append((self._expiry(ttl), value))
+        return offset[0] + len(items)
+
+    def since(self, key: str, position: int) -> tuple[int, list]:
+        offset, items = self._log(key)
+        now = time.monotonic()
+        start = max(position - offset[0], 0)
+        values = [
+            value for index, (expires_at, value) in enumerate(items)
+            if index >= start and (expires_at is None or expires_at > now)
+        ]
+        return offset[0] + len(items), values
+
+
+class MemoryStateStore(KeyValueStateStore):
+    """ State store kept in the worker's memory. Suitable for a single
+        worker and for tests; state is lost on restart.
+    """
+
+    def __init__(self):
+        self.kv = MemoryKV()
+
+    async def _get(self, key: str) -> Any:
+        return self.kv.get(key)
+
+    async def _add(self, key: str, value: Any, ttl: float | None = None) -> bool:
+        return self.kv.add(key, value, ttl)
+
+    async def _replace(self, key: str, value: Any) -> bool:
+        return self.kv.replace(key, value)
+
+    async def _delete(self, key: str) -> None:
+        self.kv.delete(key)
+
+    async def _incr(self, key: str, ttl: float | None = None) -> int:
+        return self.kv.incr(key, ttl)
+
+    async def _push(self, key: str, value: Any, ttl: float | None = None) -> int:
+        return self.kv.push(key, value, ttl)
+
+    async def _since(self, key: str, position: int) -> tuple[int, list[Any]]:
+        return self.kv.since(key, position)
+
+    async def _epoch(self) -> str:
+        return self.kv.epoch()
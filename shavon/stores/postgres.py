@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import time
+
+from typing import Any
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from shavon import db
+from shavon.models.auth import (
+    AuthUser,
+    LoginAttempt,
+)
+from shavon.models.session import (
+    Revocation,
+    Session,
+)
+from shavon.stores.base import StateStore
+from shavon.utilities import dthelpers
+
+
+# Seconds of overlap between revocation reads, so rows committed late by a
+# slow transaction are still picked up
+REVOCATION_OVERLAP = 30
+
+
+class PostgresStateStore(StateStore):
+    """ State store backed by the `sessions` and `login_attempts` tables.
+    """
+
+    async def create_session(
+        self,
+        session: AsyncSession,
+        user_id: int,
+        ip_address: str = None,
+        user_agent: str = None,
+    ) -> Session:
+        return await Session.create_session(
+            session=session,
+            user_id=user_id,
+            ip_address=ip_address,
+            user_agent=user_agent,
+        )
+
+    async def get_session(
+        self,
+        session: AsyncSession,
+        user_id: int,
+        session_key: str,
+    ) -> Session | None:
+        return await Session.get_by_user_and_key(
+            session=session,
+            user_id=user_id,
+            session_key=session_key,
+        )
+
+    async def load_auth(
+        self,
+        session: AsyncSession,
+        user_id: int,
+        session_key: str,
+    ) -> tuple[Session, AuthUser] | None:
+        # One joined query instead of a session and a user lookup
+        return await Session.get_with_user(
+            session=session,
+            user_id=user_id,
+            session_key=session_key,
+        )
+
+    async def touch(self, user_session: Session) -> None:
+        # Written in batches by Session's write-behind buffer
+        user_session.touch()
+
+    async def delete_session(
+        self,
+        session: AsyncSession,
+        user_session: Session,
+    ) -> None:
+        await Session.delete_by_key(
+            session=session,
+            session_key=user_session.session_key,
+        )
+
+    async def register_attempt(
+        self,
+        session: AsyncSession,
+        ip_address: str,
+    ) -> int:
+        """ Count the attempt in a short transaction of its own rather than
+            the caller's, so it stands however the login ends (a 503 or an
+            error included) and the row isn't locked while the password is
+            checked.
+        """
+        async with db.session() as own_session:
+            attempt_count = await LoginAttempt.register_attempt(
+                session=own_session,
+                ip_address=ip_address,
+            )
+            await own_session.commit()
+        return attempt_count
+
+    async def clear_attempts(
+        self,
+        session: AsyncSession,
+        ip_address: str,
+    ) -> None:
+        await LoginAttempt.clear(session=session, ip_address=ip_address)
+
+    async def revoke(
+        self,
+        session: AsyncSession,
+        entry: dict[str, Any],
+    ) -> None:
+        await Revocation.create(session=session, entry=entry)
+
+    async def revocations_since(
+        self,
+        session: AsyncSession,
+        cursor: float | None = None,
+    ) -> tuple[list[dict[str, Any]], float]:
+        # The cursor is a wall clock time; reading from a little before it
+        # returns some entries again, which revocation lists ignore
+        now = time.time()
+        since = None
+        if cursor is not None:
+            since = dthelpers.fromtimestamp(cursor - REVOCATION_OVERLAP)
+
+        entries = await Revocation.get_since(session=session, since=since)
+        return entries, now
@@ -0,0 +1,299 @@
+""" Fingerprinted, precompressed static assets.
+
+`build` copies every file under the static directory into a build directory
+with a hash of its content in the name, so css/sitewide.css becomes
+css/sitewide.<hash>.css, along with gzip and, when the brotli package is
+installed, brotli variants. It then writes manifest.json, which maps each
+logical name to its hashed name:
+
+    python -m shavon.utilities.assets
+
+Templates link assets with `asset_url("css/sitewide.css")`. The content of a
+hashed URL never changes, so it is served with a year-long immutable
+Cache-Control. Logical names are still served, with a short max-age, for
+anything that links them directly. Files from earlier builds are left in
+place and served from disk when requested, so pages cached before a deploy
+can still load the assets they link.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+
+from sanic.response import HTTPResponse
+
+# brotli is optional; without it only gzip variants are built
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+
+# Characters of the content hash put in file names
+HASH_LENGTH = 12
+
+# Only text formats are worth compressing; images and fonts already are
+COMPRESSIBLE = {".css", ".js", ".map", ".svg", ".json", ".txt", ".html", ".xml"}
+
+# Content-Encoding and file suffix of each variant, in order of preference
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# A fingerprinted name: the content hash before the extension, if any
+HASHED_NAME = re.compile(rf"\.([0-9a-f]{{{HASH_LENGTH}}})(?:\.[^./]+)?$")
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+
+
+def fingerprint(name: str, data: bytes) -> str:
+    """ Logical name with the content hash before its extension.
+    """
+    root, ext = os.path.splitext(name)
+    return f"{root}.{content_hash(data)}{ext}"
+
+
+def compress(data: bytes) -> dict[str, bytes]:
+    """ Compressed variants of `data` by Content-Encoding, keeping only those
+        smaller than the original.
+    """
+    variants = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(data, quality=11)
+    return {
+        encoding: body
+        for encoding, body in variants.items()
+        if len(body) < len(data)
+    }
+
+
+def _write(path: str, data: bytes) -> None:
+    """ Write a file atomically, so workers never read a partial one.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def build(source: str, target: str) -> dict[str, str]:
+    """ Write fingerprinted and compressed copies of the files under `source`
+        to `target`, and the manifest. Unchanged files aren't rewritten.
+        Returns the manifest.
+    """
+    manifest = {}
+    for directory, _, files in os.walk(source):
+        for file_name in sorted(files):
+            path = os.path.join(directory, file_name)
+            name = os.path.relpath(path, source).replace(os.sep, "/")
+            with open(path, "rb") as f:
+                data = f.read()
+
+            hashed = fingerprint(name, data)
+            manifest[name] = hashed
+
+            hashed_path = os.path.join(target, hashed)
+            if os.path.exists(hashed_path):
+                continue
+
+            _write(hashed_path, data)
+            if os.path.splitext(name)[1] in COMPRESSIBLE:
+                variants = compress(data)
+                for encoding, suffix in ENCODINGS:
+                    if encoding in variants:
+                        _write(hashed_path + suffix, variants[encoding])
+
+    _write(
+        os.path.join(target, MANIFEST),
+        json.dumps(manifest, indent=2, sort_keys=True).encode(),
+    )
+    logger.info("Built static assets", extra={"assets": len(manifest)})
+    return manifest
+
+
+class _Asset:
+    """ One asset's bodies by Content-Encoding, "" being the original.
+    """
+
+    __slots__ = ("bodies", "content_type", "digest")
+
+    def __init__(self, bodies: dict[str, bytes], content_type: str, digest: str):
+        self.bodies = bodies
+        self.content_type = content_type
+        self.digest = digest
+
+
+class StaticAssets:
+    """ Built assets held in memory, with URLs for templates and responses
+        for the static route. Load once per worker with `load`.
+    """
+
+    def __init__(self, url_prefix: str = "/static", max_age: int = 300):
+        """
+        url_prefix: path the static route is mounted at
+        max_age: Cache-Control max-age of assets requested by logical name
+        """
+        self.url_prefix = url_prefix.rstrip("/")
+        self.max_age = max_age
+        self.manifest: dict[str, str] = {}
+        # Identifies the loaded build, for caches of pages that link it
+        self.build_id = ""
+        self._assets: dict[str, _Asset] = {}
+        self._target: str | None = None
+
+    def __len__(self) -> int:
+        return len(self.manifest)
+
+    def load(self, source: str, target: str) -> None:
+        """ Read the build in `target` into memory, building it from `source`
+            first if there is none.
+        """
+        manifest_path = os.path.join(target, MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "rb") as f:
+                manifest = json.load(f)
+        else:
+            manifest = build(source, target)
+
+        assets = {}
+        for name, hashed in manifest.items():
+            # Both names share the bodies; only the hashed one is immutable
+            assets[hashed] = assets[name] = self._read(target, hashed)
+
+        self.manifest = manifest
+        self.build_id = content_hash(
+            json.dumps(manifest, sort_keys=True).encode()
+        )
+        self._assets = assets
+        self._target = target
+
+    @staticmethod
+    def _read(target: str, hashed: str) -> _Asset:
+        """ Read a built file and its compressed variants.
+        """
+        path = os.path.join(target, hashed)
+        with open(path, "rb") as f:
+            bodies = {"": f.read()}
+        for encoding, suffix in ENCODINGS:
+            if os.path.exists(path + suffix):
+                with open(path + suffix, "rb") as f:
+                    bodies[encoding] = f.read()
+
+        content_type, _ = mimetypes.guess_type(hashed)
+        return _Asset(
+            bodies,
+            content_type or "application/octet-stream",
+            content_hash(bodies[""]),
+        )
+
+    def _read_previous(self, path: str) -> _Asset | None:
+        """ Read a file left by an earlier build, keeping it in memory from
+            then on. Only files whose content matches the hash in their name
+            are served, so nothing else in the build directory is exposed.
+        """
+        match = HASHED_NAME.search(path)
+        if match is None or self._target is None:
+            return None
+        parts = path.split("/")
+        if any(part in ("", ".", "..") for part in parts):
+            return None
+        if not os.path.isfile(os.path.join(self._target, *parts)):
+            return None
+
+        asset = self._read(self._target, os.path.join(*parts))
+        if asset.digest != match.group(1):
+            return None
+        self._assets[path] = asset
+        return asset
+
+    def url(self, name: str) -> str:
+        """ URL of an asset by logical name. Names missing from the build
+            link the logical name, so a typo shows up as a 404.
+        """
+        return f"{self.url_prefix}/{self.manifest.get(name, name)}"
+
+    @staticmethod
+    def _accepted(accept_encoding: str) -> set[str]:
+        """ Content-Encodings allowed by an Accept-Encoding header.
+        """
+        accepted = set()
+        for part in accept_encoding.split(","):
+            coding, _, params = part.partition(";")
+            quality = params.strip().removeprefix("q=")
+            try:
+                if params and float(quality) == 0:
+                    continue
+            except ValueError:
+                continue
+            accepted.add(coding.strip().lower())
+        return accepted
+
+    def response(
+        self,
+        path: str,
+        accept_encoding: str = "",
+        if_none_match: str = "",
+    ) -> HTTPResponse | None:
+        """ Response for an asset path, in the best encoding the client
+            accepts. None if there is no such asset.
+        """
+        asset = self._assets.get(path) or self._read_previous(path)
+        if asset is None:
+            return None
+
+        if path in self.manifest:
+            cache_control = f"public, max-age={self.max_age}"
+        else:
+            cache_control = IMMUTABLE
+
+        encoding = ""
+        headers = {"Cache-Control": cache_control}
+        if len(asset.bodies) > 1:
+            headers["Vary"] = "Accept-Encoding"
+            accepted = self._accepted(accept_encoding)
+            for candidate, _ in ENCODINGS:
+                if candidate in asset.bodies and candidate in accepted:
+                    encoding = candidate
+                    headers["Content-Encoding"] = encoding
+                    break
+
+        # Each encoding is a different representation, with its own ETag
+        etag = f'"{asset.digest}-{encoding}"' if encoding else f'"{asset.digest}"'
+        headers["ETag"] = etag
+        if etag in if_none_match:
+            return HTTPResponse(status=304, headers=headers)
+
+        return HTTPResponse(
+            asset.bodies[encoding],
+            headers=headers,
+            content_type=asset.content_type,
+        )
+
+
+def main(argv: list[str] | None = None) -> dict[str, str]:
+    from shavon import settings
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--source", default=settings.STATIC_PATH)
+    parser.add_argument("--target", default=settings.STATIC_BUILD_PATH)
+    args = parser.parse_args(argv)
+
+    manifest = build(args.source, args.target)
+    for name, hashed in sorted(manifest.items()):
+        print(f"{name:<40}{hashed}")
+    return manifest
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,109 @@
+import asyncio
+import itertools
+import time
+
 from contextlib import asynccontextmanager
 
+from sqlalchemy import exc
+from sqlalchemy.engine import Engine, make_url
 from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
     AsyncSession, 
     create_async_engine, 
     async_sessionmaker,
 )
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.dml import UpdateBase
+
+
+def _is_connection_failure(err: BaseException) -> bool:
+    """ Check if an error means the server is unreachable, as opposed to a
+        failed query.
+    """
+    if isinstance(err, exc.DBAPIError):
+        return err.connection_invalidated or isinstance(
+            err, exc.InterfaceError
+        )
+    return isinstance(err, (exc.TimeoutError, OSError, asyncio.TimeoutError))
+
+
+class _RoutingSession(Session):
+    """ Session that sends reads to a replica until it writes.
+        Once it flushes or executes an INSERT, UPDATE, DELETE or
+        SELECT ... FOR UPDATE, it uses the primary for the rest of its life.
+        Raw text() statements are treated as reads. Writes are tracked in
+        `has_written` with or without a replica.
+    """
+
+    def __init__(self, *args, replica: Engine | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replica = replica
+        self.has_written = False
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if not self.has_written and (
+            self._flushing
+            or isinstance(clause, UpdateBase)
+            or getattr(clause, "_for_update_arg", None) is not None
+        ):
+            self.has_written = True
+
+        if self.replica is None or self.has_written:
+            return super().get_bind(mapper, clause=clause, **kwargs)
+        return self.replica
+
+
+class _Replica:
+    """ A read replica's engine and its health state.
+    """
+
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+        self.ejected_until = 0.0
+        self.failures = 0
+
+    @property
+    def healthy(self) -> bool:
+        return self.ejected_until <= time.monotonic()
+
+    def eject(self, seconds: float) -> None:
+        self.failures += 1
+        self.ejected_until = time.monotonic() + seconds
+
+
+class UnitOfWork:
+    """ A session shared by everything that handles one request.
+        The session, and so its pooled connection, is only opened when first
+        asked for, and is committed or rolled back once by `finish`.
+    """
+
+    def __init__(self, database: "AsyncDatabaseConnection"):
+        self._database = database
+        self._session: AsyncSession | None = None
+
+    @property
+    def started(self) -> bool:
+        return self._session is not None
+
+    async def session(self) -> AsyncSession:
+        if self._session is None:
+            self._session = self._database.sessionmaker()
+        return self._session
+
+    async def finish(self, commit: bool = True) -> None:
+        """ Commit (or roll back) and close the session, if one was opened.
+        """
+        session, self._session = self._session, None
+        if session is None:
+            return
+
+        try:
+            if commit:
+                await session.commit()
+            else:
+                await session.rollback()
+        finally:
+            await session.close()
 
 
 class AsyncDatabaseConnection:
@@ -14,36 +113,170 @@ class AsyncDatabaseConnection:
         driver: str,
         pool_size: int,
         max_overflow: int,
-        echo: bool = True
+        echo: bool = True,
+        pool_pre_ping: bool = False,
+        pool_recycle: int = -1,
+        pool_timeout: float = 30,
+        statement_cache_size: int | None = None,
+        command_timeout: float | None = None,
+        statement_timeout: int | None = None,
+        replicas: list[str] = (),
+        replica_eject_seconds: float = 30,
     ):
-        self._session = None
-        self._engine = create_async_engine(
-            driver,
+        """
+        driver: SQLAlchemy connection URL of the primary
+        pool_pre_ping: test connections for liveness on checkout
+        pool_recycle: replace connections older than this many seconds
+        pool_timeout: seconds to wait for a pooled connection
+        statement_cache_size: asyncpg prepared statement cache size
+        command_timeout: asyncpg client-side query timeout, in seconds
+        statement_timeout: server-side statement_timeout, in milliseconds
+        replicas: connection URLs of read replicas, each with its own pool
+        replica_eject_seconds: how long a failing replica is skipped for
+        """
+        self._engine_options = dict(
             pool_size=pool_size,
             max_overflow=max_overflow,
             echo=echo,
+            pool_pre_ping=pool_pre_ping,
+            pool_recycle=pool_recycle,
+            pool_timeout=pool_timeout,
+        )
+        self._connect_options = dict(
+            statement_cache_size=statement_cache_size,
+            command_timeout=command_timeout,
+            statement_timeout=statement_timeout,
         )
+        self.replica_eject_seconds = replica_eject_seconds
+        self._bind(driver, replicas)
+
+    def _build_engine(self, url: str) -> AsyncEngine:
+        return create_async_engine(
+            url,
+            connect_args=self._connect_args(url, **self._connect_options),
+            **self._engine_options,
+        )
+
+    def _bind(self, driver: str, replicas: list[str]) -> None:
+        """ Remember the URLs to connect to. Engines are built on first use,
+            so that each worker process creates its own pools.
+        """
+        self._driver = driver
+        self._replica_urls = list(replicas)
+        self._engine = None
+        self._replicas = []
+        self._replica_cycle = itertools.cycle(self._replicas)
+        self._sessionmaker = None
 
-    def __getattr__(self, name):
-        return getattr(self._session, name)
+    def rebind(self, driver: str, replicas: list[str] = ()) -> None:
+        """ Point the connection at another database, keeping the pool
+            options, e.g. for benchmarks. Call it before the connection is
+            used; pools of the previous engines are not closed.
+        """
+        self._bind(driver, replicas)
+
+    def connect(self) -> None:
+        """ Build the engines and sessionmaker, if not built yet. No
+            connection is opened until a session needs one.
+        """
+        if self._engine is not None:
+            return
+
+        self._engine = self._build_engine(self._driver)
+        self._replicas = [
+            _Replica(self._build_engine(url)) for url in self._replica_urls
+        ]
+        self._replica_cycle = itertools.cycle(self._replicas)
+
+        # Built once; creating a session from it is cheap
+        self._sessionmaker = async_sessionmaker(
+            self._engine,
+            class_=AsyncSession,
+            sync_session_class=_RoutingSession,
+            expire_on_commit=False,
+        )
+
+    @staticmethod
+    def _connect_args(
+        driver: str,
+        statement_cache_size: int | None,
+        command_timeout: float | None,
+        statement_timeout: int | None,
+    ) -> dict:
+        """ Build asyncpg connect() arguments. Other drivers get none.
+        """
+        if make_url(driver).get_driver_name() != "asyncpg":
+            return {}
+
+        connect_args = {}
+        if statement_cache_size is not None:
+            connect_args["statement_cache_size"] = statement_cache_size
+        if command_timeout:
+            connect_args["command_timeout"] = command_timeout
+        if statement_timeout:
+            connect_args["server_settings"] = {
+                "statement_timeout": str(statement_timeout),
+            }
+        return connect_args
+
+    @property
+    def engine(self) -> AsyncEngine:
+        self.connect()
+        return self._engine
+
+    @property
+    def sessionmaker(self) -> async_sessionmaker[AsyncSession]:
+        self.connect()
+        return self._sessionmaker
+
+    def _pick_replica(self) -> _Replica | None:
+        """ Round-robin over healthy replicas. None if there are none.
+        """
+        for _ in range(len(self._replicas)):
+            replica = next(self._replica_cycle)
+            if replica.healthy:
+                return replica
+        return None
 
     @asynccontextmanager
-    async def session(self):
-        try:
-            async_sess = async_sessionmaker(
-                self._engine, 
-                class_=AsyncSession, 
-                expire_on_commit=False
-            )
+    async def session(self, readonly: bool = False):
+        """ Open a session on the primary.
+            With `readonly`, reads go to a healthy replica (or the primary if
+            there is none) until the session writes, after which everything
+            goes to the primary. A replica that fails to connect is ejected
+            for `replica_eject_seconds`.
+        """
+        self.connect()
+        replica = self._pick_replica() if readonly else None
+        sync_replica = replica.engine.sync_engine if replica else None
 
-            async with async_sess() as sess:
+        async with self._sessionmaker(replica=sync_replica) as sess:
+            try:
                 yield sess
-        except:
-            await sess.rollback()
-            raise
-        finally:
-            await sess.close()
+            except BaseException as err:
+                if (
+                    replica
+                    and not sess.sync_session.has_written
+                    and _is_connection_failure(err)
+                ):
+                    replica.eject(self.replica_eject_seconds)
+                await sess.rollback()
+                raise
 
-    async def close(self):
-        self._engine.dispose()
+    def unit_of_work(self) -> UnitOfWork:
+        """ Create a lazily opened, request-scoped session on the primary.
+        """
+        return UnitOfWork(self)
 
+    async def dispose(self):
+        """ Close every pooled connection, including replica pools. The
+            engines stay usable and will open new connections on demand.
+        """
+        if self._engine is None:
+            return
+        await self._engine.dispose()
+        for replica in self._replicas:
+            await replica.engine.dispose()
+
+    async def close(self):
+        await self.dispose()
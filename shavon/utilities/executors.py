@@ -0,0 +1,81 @@
+import asyncio
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from shavon.exceptions import ServiceBusy
+
+
+class BoundedExecutor:
+    """ Thread pool for CPU heavy work that must stay off the event loop.
+        At most `max_workers` jobs run at once and at most `max_queue` more
+        may wait for a thread. Anything beyond that is rejected immediately
+        with ServiceBusy instead of piling up behind the pool.
+    """
+
+    def __init__(
+        self,
+        max_workers: int,
+        max_queue: int,
+        name: str = "shavon-executor",
+        retry_after: int = 1,
+    ):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.name = name
+        self.retry_after = retry_after
+        self._executor = None
+        self._pending = 0
+        # Jobs finish on pool threads, which decrement `_pending` too
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        # Threads are started lazily so that they are created after the
+        # worker process has been forked/spawned.
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix=self.name,
+            )
+        return self._executor
+
+    @property
+    def pending(self) -> int:
+        """ Number of jobs currently running or waiting for a thread.
+        """
+        return self._pending
+
+    async def run(self, func: Callable, *args: Any, **kwargs: Any) -> Any:
+        """ Run `func` on the pool and await its result.
+            Raises ServiceBusy when the pool and its queue are full.
+            A job counts against the bound until its thread is done with it,
+            even if the caller is cancelled first.
+        """
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise ServiceBusy(
+                    "Server is busy, please try again shortly.",
+                    retry_after=self.retry_after,
+                )
+            self._pending += 1
+
+        try:
+            future = self.executor.submit(func, *args, **kwargs)
+        except BaseException:
+            self._done()
+            raise
+        future.add_done_callback(self._done)
+        return await asyncio.wrap_future(future)
+
+    def _done(self, future: Any = None) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def shutdown(self, wait: bool = True) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
@@ -0,0 +1,39 @@
+""" Checks for files shared between Shavon's processes, such as the state
+store socket and the metrics snapshots, so another local user can't plant
+or read them.
+"""
+import os
+import stat
+
+
+def check_owned(path: str, st: os.stat_result) -> None:
+    """ Raise PermissionError unless `st`, the lstat of `path`, belongs to
+        this user.
+    """
+    if st.st_uid != os.getuid():
+        raise PermissionError(
+            f"{path} belongs to another user; refusing to use it"
+        )
+
+
+def private_directory(path: str, create: bool = True) -> bool:
+    """ Make sure `path` is a directory of this user's that other users can't
+        write to, creating it with mode 0700 if missing and `create` is set.
+        Returns whether it exists. Raises PermissionError for a directory
+        that fails the check, or anything else at `path`, symlinks included.
+    """
+    if create:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return False
+
+    check_owned(path, st)
+    if not stat.S_ISDIR(st.st_mode) or st.st_mode & 0o022:
+        raise PermissionError(
+            f"{path} isn't a directory only this user can write to; "
+            "refusing to use it"
+        )
+    return True
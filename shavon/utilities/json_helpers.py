@@ -1,12 +1,128 @@
+import dataclasses
+import enum
+import json
+
+from datetime import date, datetime, time
 from typing import Any
+from uuid import UUID
 
 import sanic
+from pydantic import BaseModel
+from sanic.response import HTTPResponse
 from sanic.response.types import JSONResponse
 
+from shavon.utilities import metrics
+
+# orjson is optional; the stdlib encoder is used without it
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# SERIALIZATION
+def _default(obj: Any) -> Any:
+    """
+    Serialize types the json encoders don't know about. The stdlib encoder
+    also gets the types orjson handles natively, serialized the same way.
+    """
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    if isinstance(obj, UUID):
+        return str(obj)
+    if isinstance(obj, enum.Enum):
+        return obj.value
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return {
+            field.name: getattr(obj, field.name)
+            for field in dataclasses.fields(obj)
+        }
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _stdlib_dumps(obj: Any, **kwargs: Any) -> str:
+    """
+    Serialize to compact JSON with the stdlib encoder, or indented like
+    orjson when `indent` is given.
+    """
+    indented = kwargs.get("indent") is not None
+    kwargs.setdefault("separators", (",", ": ") if indented else (",", ":"))
+    kwargs.setdefault("ensure_ascii", False)
+    kwargs.setdefault("default", _default)
+    return json.dumps(obj, **kwargs)
+
+
+# Arguments orjson has an equivalent for; any other uses the stdlib encoder
+ORJSON_ARGUMENTS = {"indent", "sort_keys", "default"}
+
+
+if orjson is not None:
+    # Like the stdlib encoder, accept int, float, bool and None keys.
+    # Dataclasses go through _default, so sort_keys sorts their fields too
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATACLASS
+
+    def dumps(obj: Any, **kwargs: Any) -> bytes | str:
+        """
+        Serialize to compact JSON with orjson. `indent=2`, `sort_keys` and
+        `default` are mapped to orjson's options; other arguments fall back
+        to the stdlib encoder, so the output doesn't depend on which is
+        installed.
+        """
+        if not kwargs:
+            return orjson.dumps(obj, default=_default, option=ORJSON_OPTIONS)
+
+        indent = kwargs.get("indent")
+        if kwargs.keys() - ORJSON_ARGUMENTS or indent not in (None, 2):
+            return _stdlib_dumps(obj, **kwargs)
+
+        option = ORJSON_OPTIONS
+        if indent == 2:
+            option |= orjson.OPT_INDENT_2
+        if kwargs.get("sort_keys"):
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(
+            obj,
+            default=kwargs.get("default", _default),
+            option=option,
+        )
+else:
+    dumps = _stdlib_dumps
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """
+    Serialize to compact JSON, always as bytes.
+    """
+    body = dumps(obj)
+    return body.encode("utf-8") if isinstance(body, str) else body
+
+
+class PreparedJSON:
+    """
+    A JSON body serialized once, for responses sent unchanged many times.
+    """
+
+    def __init__(self, body: Any):
+        self.body = dumps_bytes(body)
+
+    def response(
+        self,
+        http_status: int = 200,
+        headers: dict[str, str] | None = None,
+    ) -> HTTPResponse:
+        return HTTPResponse(
+            self.body,
+            status=http_status,
+            headers=headers,
+            content_type="application/json",
+        )
+
 
 # AJAX HELPERS
 def basic_json(
-    status: str, 
+    status: str,
     **kwargs: dict[str: Any],
 ) -> dict[str: Any]:
 
@@ -33,19 +149,54 @@ def ok_json(**kwargs: dict[str, Any]) -> dict[str, Any]:
 
 
 def fail_response(
+    http_status: int = 200,
+    headers: dict[str, str] | None = None,
     **kwargs: dict[str, Any],
 ) -> JSONResponse:
     """
     Build and return a json fail message.
     """
     json_response = fail_json(**kwargs)
-    return sanic.json(json_response)
+    with metrics.timed("serialize"):
+        return sanic.json(
+            json_response,
+            status=http_status,
+            headers=headers,
+            dumps=dumps,
+        )
 
 
-def ok_response(**kwargs: dict[str, Any],) -> JSONResponse:
+def ok_response(
+    http_status: int = 200,
+    headers: dict[str, str] | None = None,
+    **kwargs: dict[str, Any],
+) -> JSONResponse:
     """
     Build and return a json fail message.
     """
     json_response = ok_json(**kwargs)
-    return sanic.json(json_response)
+    with metrics.timed("serialize"):
+        return sanic.json(
+            json_response,
+            status=http_status,
+            headers=headers,
+            dumps=dumps,
+        )
+
 
+def model_response(
+    model: BaseModel,
+    http_status: int = 200,
+    headers: dict[str, str] | None = None,
+) -> HTTPResponse:
+    """
+    Return a pydantic model as JSON, serialized by pydantic directly.
+    """
+    with metrics.timed("serialize"):
+        body = model.model_dump_json()
+    return HTTPResponse(
+        body,
+        status=http_status,
+        headers=headers,
+        content_type="application/json",
+    )
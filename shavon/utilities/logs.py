@@ -0,0 +1,75 @@
+""" Logging setup for Shavon's own loggers.
+
+Log calls pass their fields through `extra`, so that each record carries them
+as attributes:
+
+    logger.info("Login attempt", extra={"ip": request.ip, "attempts": 3})
+
+The text format appends the fields as `key=value` pairs and the json format
+writes one object per line.
+"""
+import json
+import logging
+import sys
+
+
+# Attributes every LogRecord has, as opposed to fields passed through `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+def _fields(record: logging.LogRecord) -> dict:
+    return {
+        key: value for key, value in vars(record).items()
+        if key not in _RECORD_ATTRIBUTES
+    }
+
+
+class KeyValueFormatter(logging.Formatter):
+    """ Text format with the record's fields appended as `key=value`.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = super().format(record)
+        fields = " ".join(f"{k}={v!r}" for k, v in _fields(record).items())
+        return f"{message} {fields}" if fields else message
+
+
+class JSONFormatter(logging.Formatter):
+    """ One JSON object per record, with its fields at the top level.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **_fields(record),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level: str = "INFO", format: str = "text") -> None:
+    """ Send the `shavon` loggers to stderr in the given format. Calling it
+        again replaces the previous setup.
+    """
+    if format == "json":
+        formatter = JSONFormatter()
+    elif format == "text":
+        formatter = KeyValueFormatter(
+            "%(asctime)s %(levelname)s %(name)s: %(message)s"
+        )
+    else:
+        raise ValueError(f"Unknown log format: {format}")
+
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(formatter)
+
+    logger = logging.getLogger("shavon")
+    for existing in list(logger.handlers):
+        logger.removeHandler(existing)
+    logger.addHandler(handler)
+    logger.setLevel(level.upper())
+    logger.propagate = False
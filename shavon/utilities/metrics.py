@@ -0,0 +1,440 @@
+""" In-process metrics with Prometheus text output.
+
+Every worker records into its own `registry` with fixed-bucket histograms,
+so an observation is a bisect and two additions. Workers write a snapshot
+to `<METRICS_DIR>/<pid>.json` every few seconds and `/_metrics` merges the
+snapshots of every worker on the host.
+
+Request latency is broken into stages (jwt, db, render, serialize). Code
+records a stage with `timed(stage)` or `record_stage`, and the time is
+attributed to the route of the request being handled, which is tracked in
+a context variable by the metrics middleware.
+"""
+import asyncio
+import bisect
+import contextvars
+import json
+import logging
+import os
+import time
+
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from shavon.utilities.fshelpers import private_directory
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds; suits both sub-millisecond stages and whole requests
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class Histogram:
+    """ Histogram with fixed upper bounds. Bucket counts are kept per bucket
+        and only made cumulative when exported.
+    """
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            # One count per bucket plus +Inf, then the sum
+            series = [[0] * (len(self.buckets) + 1), 0.0]
+            self._series[labels] = series
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "help": self.help,
+            "labelnames": list(self.labelnames),
+            "buckets": list(self.buckets),
+            "series": [
+                [list(labels), counts[:], total]
+                for labels, (counts, total) in self._series.items()
+            ],
+        }
+
+
+class Counter:
+    """ Monotonic total. `set` mirrors a total kept by another component.
+    """
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._series: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, *labels: str) -> None:
+        self._series[labels] = self._series.get(labels, 0) + amount
+
+    def set(self, value: float, *labels: str) -> None:
+        self._series[labels] = value
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "help": self.help,
+            "labelnames": list(self.labelnames),
+            "series": [
+                [list(labels), value] for labels, value in self._series.items()
+            ],
+        }
+
+
+class Gauge(Counter):
+    """ Current value. Gauges of workers that have exited are not exported.
+    """
+    kind = "gauge"
+
+
+class Registry:
+    """ The metrics of one worker, plus collectors that update gauges from
+        other components just before a snapshot is taken.
+    """
+
+    def __init__(self):
+        self._metrics: dict[str, Histogram | Counter] = {}
+        self._collectors: list[Callable[[], None]] = []
+
+    def _get_or_create(self, cls: type, name: str, *args: Any, **kwargs: Any):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, *args, **kwargs)
+        elif type(metric) is not cls:
+            raise ValueError(f"Metric {name} is already a {metric.kind}")
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._get_or_create(Histogram, name, help, labelnames, buckets)
+
+    def counter(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+    ) -> Counter:
+        return self._get_or_create(Counter, name, help, labelnames)
+
+    def gauge(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+    ) -> Gauge:
+        return self._get_or_create(Gauge, name, help, labelnames)
+
+    def collector(self, func: Callable[[], None]) -> Callable[[], None]:
+        """ Decorator registering a function to run before each snapshot.
+        """
+        self._collectors.append(func)
+        return func
+
+    def snapshot(self) -> dict[str, Any]:
+        for collect in self._collectors:
+            try:
+                collect()
+            except Exception:
+                logger.exception("Metrics collector %s failed", collect.__name__)
+
+        return {
+            "pid": os.getpid(),
+            "metrics": {
+                name: metric.snapshot() for name, metric in self._metrics.items()
+            },
+        }
+
+
+# This worker's metrics
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    "shavon_request_duration_seconds",
+    "Time from routing a request to starting its response.",
+    ("route", "method", "status"),
+)
+STAGE_SECONDS = registry.histogram(
+    "shavon_request_stage_seconds",
+    "Time spent in each stage of handling a request.",
+    ("route", "stage"),
+)
+REQUEST_QUERIES = registry.histogram(
+    "shavon_request_queries",
+    "Database queries made per request.",
+    ("route",),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34),
+)
+
+
+# STAGE TIMING
+class RequestTimer:
+    __slots__ = ("route", "started", "queries")
+
+    def __init__(self, route: str):
+        self.route = route
+        self.started = time.perf_counter()
+        self.queries = 0
+
+
+_request_timer: contextvars.ContextVar[RequestTimer | None] = (
+    contextvars.ContextVar("shavon_request_timer", default=None)
+)
+
+
+def start_request(route: str) -> RequestTimer:
+    """ Start attributing stages to `route` in the current context.
+    """
+    timer = RequestTimer(route)
+    _request_timer.set(timer)
+    return timer
+
+
+def finish_request(method: str, status: int) -> None:
+    """ Record the current request's duration and query count. Stages that
+        finish later, such as a streamed render, are still recorded.
+    """
+    timer = _request_timer.get()
+    if timer is None:
+        return
+
+    elapsed = time.perf_counter() - timer.started
+    REQUEST_SECONDS.observe(elapsed, timer.route, method, str(status))
+    REQUEST_QUERIES.observe(timer.queries, timer.route)
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    """ Add time spent in a stage to the current request, if there is one.
+    """
+    timer = _request_timer.get()
+    if timer is not None:
+        STAGE_SECONDS.observe(seconds, timer.route, stage)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """ Record the time spent in a block as a stage of the current request.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+
+def _before_cursor_execute(conn, cursor, statement, params, context, many):
+    # A connection runs one statement at a time, and a failed statement's
+    # start is simply overwritten by the next one
+    conn.info["shavon_query_started"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, params, context, many):
+    timer = _request_timer.get()
+    if timer is not None:
+        elapsed = time.perf_counter() - conn.info["shavon_query_started"]
+        timer.queries += 1
+        STAGE_SECONDS.observe(elapsed, timer.route, "db")
+
+
+def instrument_queries() -> None:
+    """ Time every query of every engine, including ones created later.
+    """
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# EXPORT
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def write_snapshot(directory: str, snapshot: dict[str, Any] | None = None) -> None:
+    """ Write this worker's snapshot, replacing the previous one atomically.
+    """
+    snapshot = snapshot or registry.snapshot()
+    private_directory(directory)
+    path = os.path.join(directory, f"{snapshot['pid']}.json")
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(snapshot, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def read_snapshots(directory: str) -> list[dict[str, Any]]:
+    """ Read the snapshots of every worker, with this worker's taken live.
+    """
+    current = registry.snapshot()
+    snapshots = [current]
+
+    if private_directory(directory, create=False):
+        for file_name in os.listdir(directory):
+            if not file_name.endswith(".json"):
+                continue
+            if file_name == f"{current['pid']}.json":
+                continue
+            try:
+                with open(os.path.join(directory, file_name)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                # Being replaced, or left half written by a crash
+                continue
+
+    return snapshots
+
+
+def clear_snapshots(directory: str) -> None:
+    """ Remove snapshots left by a previous run.
+    """
+    if private_directory(directory, create=False):
+        for file_name in os.listdir(directory):
+            if file_name.endswith((".json", ".tmp")):
+                os.unlink(os.path.join(directory, file_name))
+
+
+def merge(snapshots: list[dict[str, Any]]) -> dict[str, dict[str, Any]]:
+    """ Sum the snapshots of several workers. Gauges are only taken from
+        workers that are still running.
+    """
+    merged: dict[str, dict[str, Any]] = {}
+    for snapshot in snapshots:
+        alive = snapshot["pid"] == os.getpid() or _pid_alive(snapshot["pid"])
+        for name, metric in snapshot["metrics"].items():
+            if metric["kind"] == "gauge" and not alive:
+                continue
+
+            target = merged.setdefault(name, {**metric, "series": {}})
+            for labels, *values in metric["series"]:
+                key = tuple(labels)
+                if metric["kind"] == "histogram":
+                    counts, total = values
+                    if key in target["series"]:
+                        current = target["series"][key]
+                        current[0] = [a + b for a, b in zip(current[0], counts)]
+                        current[1] += total
+                    else:
+                        target["series"][key] = [list(counts), total]
+                else:
+                    target["series"][key] = target["series"].get(key, 0) + values[0]
+
+    return merged
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: list[str], values: tuple[str, ...], **extra: str) -> str:
+    pairs = list(zip(names, values)) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def render(merged: dict[str, dict[str, Any]]) -> str:
+    """ Format merged metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    for name in sorted(merged):
+        metric = merged[name]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        names = metric["labelnames"]
+
+        for labels, value in sorted(metric["series"].items()):
+            if metric["kind"] != "histogram":
+                labels = _format_labels(names, labels)
+                lines.append(f"{name}{labels} {_format_value(value)}")
+                continue
+
+            counts, total = value
+            cumulative = 0
+            for bound, count in zip(metric["buckets"] + ["+Inf"], counts):
+                cumulative += count
+                le = bound if bound == "+Inf" else _format_value(float(bound))
+                lines.append(
+                    f"{name}_bucket{_format_labels(names, labels, le=le)} {cumulative}"
+                )
+            labels = _format_labels(names, labels)
+            lines.append(f"{name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{name}_count{labels} {cumulative}")
+
+    return "\n".join(lines) + "\n"
+
+
+class SnapshotWriter:
+    """ Writes this worker's snapshot every `interval` seconds, and once more
+        when stopped.
+    """
+
+    def __init__(self, directory: str, interval: float, name: str = "metrics"):
+        self.directory = directory
+        self.interval = interval
+        self.name = name
+        self._task: asyncio.Task | None = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                write_snapshot(self.directory)
+            except Exception:
+                logger.exception("%s snapshot failed", self.name)
+
+    def start(self) -> None:
+        """ Start the periodic snapshot task on the running event loop.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name=self.name)
+
+    async def stop(self) -> None:
+        """ Stop the periodic task and write a final snapshot.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        write_snapshot(self.directory)
@@ -0,0 +1,71 @@
+import functools
+import sanic
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from shavon import db
+from shavon import settings
+from shavon.utilities import metrics
+
+
+async def request_session(request: sanic.Request) -> AsyncSession:
+    """ Return the request's shared database session, opening it on first use.
+        It is only committed by handlers decorated with `transactional`, and
+        otherwise rolled back when the response is sent.
+    """
+    return await request.ctx.uow.session()
+
+
+def transactional(func):
+    """ Commit the request's session when the handler returns a successful
+        response, before the response is sent, so that a failed commit is
+        reported as an error instead of following a success. Handlers that
+        stream their response send it themselves and shouldn't write.
+    """
+    @functools.wraps(func)
+    async def wrapper(request, *args, **kwargs):
+        response = await func(request, *args, **kwargs)
+        if response is not None and response.status < 400:
+            await request.ctx.uow.finish(commit=True)
+        return response
+
+    return wrapper
+
+
+async def open_unit_of_work(request: sanic.Request) -> None:
+    request.ctx.uow = db.unit_of_work()
+
+
+async def finish_unit_of_work(
+    request: sanic.Request,
+    response: sanic.HTTPResponse,
+) -> None:
+    # Whatever a `transactional` handler didn't commit is discarded
+    uow = getattr(request.ctx, "uow", None)
+    if uow is not None:
+        await uow.finish(commit=False)
+
+
+async def start_request_metrics(request: sanic.Request) -> None:
+    metrics.start_request(request.name or "unmatched")
+
+
+async def finish_request_metrics(
+    request: sanic.Request,
+    response: sanic.HTTPResponse,
+) -> None:
+    metrics.finish_request(request.method, response.status)
+
+
+def register_middleware(app: sanic.Sanic) -> None:
+    """ Attach Shavon's request and response middleware to the app.
+        Response middleware runs in reverse order, so request metrics
+        include closing the unit of work.
+    """
+    if settings.METRICS_ENABLED:
+        metrics.instrument_queries()
+        app.register_middleware(start_request_metrics, "request")
+        app.register_middleware(finish_request_metrics, "response")
+
+    app.register_middleware(open_unit_of_work, "request")
+    app.register_middleware(finish_unit_of_work, "response")
@@ -0,0 +1,192 @@
+""" Per-worker cache of rendered pages for anonymous visitors.
+
+Views that render the same HTML for everyone who isn't signed in opt in with
+`cached_page`, under the route decorator:
+
+    @blueprint.route("/", methods=["GET"])
+    @cached_page()
+    async def index(request):
+        return await stream_template("info/index.html", settings, request)
+
+Pages rendered from one record, which anyone may view, are cached by the
+record's version with `versioned_page` instead; see profile.profile_view.
+
+While a page is being cached, `request.ctx.buffer_response` is set so that
+`stream_template` returns a response instead of streaming one.
+"""
+import functools
+import hashlib
+
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Awaitable, Callable, Hashable, Iterable
+
+import sanic
+
+from sanic.response import HTTPResponse
+
+from shavon import page_cache
+from shavon import settings
+from shavon import static_assets
+from shavon.utilities import templating
+
+
+class CachedPage:
+    """ A rendered response body with its strong ETag.
+    """
+
+    __slots__ = ("body", "content_type", "etag")
+
+    def __init__(self, body: bytes, content_type: str):
+        self.body = body
+        self.content_type = content_type
+        self.etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+
+
+def bypass(request: sanic.Request) -> bool:
+    """ Whether the page may differ from what an anonymous visitor gets.
+    """
+    return (
+        settings.AUTH_COOKIE_NAME in request.cookies
+        or hasattr(request.ctx, "notices")
+    )
+
+
+def _respond(
+    request: sanic.Request,
+    page: CachedPage,
+    headers: dict[str, str],
+) -> HTTPResponse:
+    headers = {**headers, "ETag": page.etag}
+    if page.etag in request.headers.get("if-none-match", ""):
+        return HTTPResponse(status=304, headers=headers)
+    return HTTPResponse(page.body, headers=headers, content_type=page.content_type)
+
+
+def cached_page(
+    vary: Iterable[str] = (),
+    ttl: float | None = None,
+) -> Callable:
+    """ Cache a view's 200 responses for anonymous visitors, keyed by route,
+        path and query string, plus the values of the `vary` request headers.
+        Cached pages are answered with 304 when If-None-Match matches.
+
+        vary: request headers the page depends on, e.g. Accept-Language
+        ttl: seconds to keep a page, PAGE_CACHE_TTL by default
+    """
+    vary = tuple(header.lower() for header in vary)
+    # Browsers revalidate every time, and shared caches keep signed in
+    # visitors' pages apart
+    headers = {
+        "Cache-Control": "no-cache",
+        "Vary": ", ".join(("Cookie",) + vary),
+    }
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(request, *args, **kwargs):
+            if not settings.PAGE_CACHE_ENABLED or bypass(request):
+                return await func(request, *args, **kwargs)
+
+            key = (
+                request.name,
+                request.path,
+                request.query_string,
+                *(request.headers.get(header, "") for header in vary),
+            )
+            page = page_cache.get(key)
+            if page is not None:
+                return _respond(request, page, headers)
+
+            request.ctx.buffer_response = True
+            response = await func(request, *args, **kwargs)
+
+            # Only plain pages rendered for an anonymous visitor are shared
+            if (
+                response is None
+                or response.status != 200
+                or "set-cookie" in response.headers
+                or hasattr(request.ctx, "notices")
+            ):
+                return response
+
+            page = CachedPage(response.body, response.content_type)
+            page_cache.set(key, page, ttl)
+            return _respond(request, page, headers)
+
+        return wrapper
+    return decorator
+
+
+def _not_modified(
+    request: sanic.Request,
+    etag: str,
+    modified: datetime,
+) -> bool:
+    """ Whether the client's copy is current. If-Modified-Since only counts
+        without If-None-Match.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag in if_none_match
+
+    try:
+        since = parsedate_to_datetime(request.headers["if-modified-since"])
+    except (KeyError, TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return modified.replace(microsecond=0) <= since
+
+
+async def versioned_page(
+    request: sanic.Request,
+    key: Hashable,
+    modified: datetime,
+    render: Callable[[], Awaitable[HTTPResponse | None]],
+    ttl: float | None = None,
+) -> HTTPResponse | None:
+    """ Serve a page determined by `key`, such as (user_id, version), which
+        changes whenever the content does, and was last changed at `modified`.
+        The ETag and Last-Modified come from these and from the templates
+        and static assets deployed, so 304s need no render. Otherwise the
+        page is served from the cache, or by awaiting `render` and caching
+        its 200 response. Other responses are returned as is.
+    """
+    if not settings.PAGE_CACHE_ENABLED or bypass(request):
+        return await render()
+
+    # A deploy changes the page without changing the record
+    templates, templates_modified = templating.templates_version(settings)
+    build = (settings.APP_VERSION, templates, static_assets.build_id)
+    modified = max(
+        modified,
+        datetime.fromtimestamp(templates_modified, timezone.utc),
+    )
+
+    digest = hashlib.sha256(
+        repr((build, request.name, key)).encode()
+    ).hexdigest()[:16]
+    etag = f'"{digest}"'
+    headers = {
+        "Cache-Control": "no-cache",
+        "Vary": "Cookie",
+        "ETag": etag,
+        "Last-Modified": format_datetime(
+            modified.astimezone(timezone.utc), usegmt=True,
+        ),
+    }
+    if _not_modified(request, etag, modified):
+        return HTTPResponse(status=304, headers=headers)
+
+    cache_key = (request.name, build, key)
+    page = page_cache.get(cache_key)
+    if page is None:
+        request.ctx.buffer_response = True
+        response = await render()
+        if response is None or response.status != 200:
+            return response
+        page = CachedPage(response.body, response.content_type)
+        page_cache.set(cache_key, page, ttl)
+
+    return HTTPResponse(page.body, headers=headers, content_type=page.content_type)
@@ -0,0 +1,178 @@
+""" Password hashing schemes.
+
+Hashes are stored in a self-describing format so that the scheme and its
+cost can change without resetting existing passwords:
+
+    $<scheme>$<param>=<value>,...$<hex salt>$<hex digest>
+
+Hashes created before this format existed (a 64 character hex salt followed
+by a PBKDF2-SHA512 hex digest) are still read through `LegacyPBKDF2Hasher`.
+"""
+import hashlib
+import hmac
+import logging
+import os
+
+from abc import ABC, abstractmethod
+
+
+logger = logging.getLogger(__name__)
+
+# Registered hashers, keyed by scheme name
+HASHERS: dict[str, type["PasswordHasher"]] = {}
+
+
+def register_hasher(cls: type["PasswordHasher"]) -> type["PasswordHasher"]:
+    """ Class decorator adding a hasher to the registry under its scheme.
+    """
+    HASHERS[cls.scheme] = cls
+    return cls
+
+
+class PasswordHasher(ABC):
+    """ Base class for password hashing schemes.
+        Subclasses set `scheme` and `default_params` and implement `derive`.
+    """
+    scheme: str = ""
+    default_params: dict[str, int] = {}
+    salt_bytes: int = 16
+
+    def __init__(self, **params: int):
+        unknown = set(params) - set(self.default_params)
+        if unknown:
+            raise ValueError(
+                f"Unknown parameters for {self.scheme}: {sorted(unknown)}"
+            )
+        self.params = {**self.default_params, **params}
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.describe()}>"
+
+    def describe(self) -> str:
+        """ Return the scheme and parameters as `scheme$k=v,...`.
+        """
+        params = ",".join(f"{k}={v}" for k, v in sorted(self.params.items()))
+        return f"{self.scheme}${params}"
+
+    @abstractmethod
+    def derive(self, password: bytes, salt: bytes) -> bytes:
+        ...
+
+    def hash(self, password: str, salt: str = None) -> str:
+        """ Hash a password, generating a new hex salt if none is given.
+        """
+        if not salt:
+            salt = os.urandom(self.salt_bytes).hex()
+
+        digest = self.derive(password.encode("utf-8"), bytes.fromhex(salt))
+        return f"${self.describe()}${salt}${digest.hex()}"
+
+    def verify(self, password: str, salt: str, digest: str) -> bool:
+        """ Compare a plaintext password against a salt and hex digest in
+            constant time.
+        """
+        pwdhash = self.derive(password.encode("utf-8"), bytes.fromhex(salt))
+        return hmac.compare_digest(pwdhash.hex(), digest)
+
+
+@register_hasher
+class PBKDF2SHA512Hasher(PasswordHasher):
+    scheme = "pbkdf2-sha512"
+    default_params = {"i": 100000}
+
+    def derive(self, password: bytes, salt: bytes) -> bytes:
+        return hashlib.pbkdf2_hmac("sha512", password, salt, self.params["i"])
+
+
+@register_hasher
+class PBKDF2SHA256Hasher(PasswordHasher):
+    scheme = "pbkdf2-sha256"
+    default_params = {"i": 600000}
+
+    def derive(self, password: bytes, salt: bytes) -> bytes:
+        return hashlib.pbkdf2_hmac("sha256", password, salt, self.params["i"])
+
+
+@register_hasher
+class ScryptHasher(PasswordHasher):
+    scheme = "scrypt"
+    default_params = {"n": 2**14, "r": 8, "p": 1}
+
+    def derive(self, password: bytes, salt: bytes) -> bytes:
+        n, r, p = self.params["n"], self.params["r"], self.params["p"]
+        return hashlib.scrypt(
+            password,
+            salt=salt,
+            n=n,
+            r=r,
+            p=p,
+            # Allow a little headroom over the 128 * n * r bytes scrypt needs
+            maxmem=256 * n * r * p + 1024 * 1024,
+            dklen=64,
+        )
+
+
+class LegacyPBKDF2Hasher(PBKDF2SHA512Hasher):
+    """ Reads hashes stored as `<64 char hex salt><hex digest>`.
+        The salt's ascii characters, not its decoded bytes, were the salt.
+    """
+
+    def verify(self, password: str, salt: str, digest: str) -> bool:
+        pwdhash = self.derive(password.encode("utf-8"), salt.encode("ascii"))
+        return hmac.compare_digest(pwdhash.hex(), digest)
+
+
+def get_hasher(scheme: str, params: str = "") -> PasswordHasher:
+    """ Build a hasher from a scheme name and a `k=v,...` parameter string.
+    """
+    if scheme not in HASHERS:
+        raise ValueError(f"Unknown password hash scheme: {scheme}")
+
+    parsed = {}
+    for item in filter(None, params.split(",")):
+        key, _, value = item.partition("=")
+        parsed[key.strip()] = int(value)
+
+    return HASHERS[scheme](**parsed)
+
+
+def identify(hashed_password: str) -> tuple[PasswordHasher, str, str]:
+    """ Split a stored hash into the hasher that made it, its salt and its
+        digest.
+    """
+    if not hashed_password.startswith("$"):
+        return (
+            LegacyPBKDF2Hasher(),
+            hashed_password[:64],
+            hashed_password[64:],
+        )
+
+    try:
+        _, scheme, params, salt, digest = hashed_password.split("$")
+    except ValueError:
+        raise ValueError("Malformed password hash") from None
+
+    return get_hasher(scheme, params), salt, digest
+
+
+def verify_password(hashed_password: str, pt_password: str) -> bool:
+    """ Verify a plaintext password against a stored hash of any scheme.
+        A malformed stored hash fails verification, and is logged.
+    """
+    try:
+        hasher, salt, digest = identify(hashed_password)
+        return hasher.verify(pt_password, salt, digest)
+    except ValueError as err:
+        logger.warning("Unreadable password hash", extra={"error": str(err)})
+        return False
+
+
+def needs_rehash(hashed_password: str, target: PasswordHasher) -> bool:
+    """ Return True when a stored hash wasn't made with the target scheme
+        and parameters.
+    """
+    if not hashed_password.startswith("$"):
+        return True
+
+    hasher, _, _ = identify(hashed_password)
+    return hasher.describe() != target.describe()
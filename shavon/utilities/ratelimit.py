@@ -0,0 +1,56 @@
+import math
+import time
+
+from collections import OrderedDict
+from typing import Hashable
+
+
+class TokenBucketLimiter:
+    """ Per-process token bucket rate limiter keyed by e.g. client IP.
+        Each key may burst up to `burst` requests and then refills at `rate`
+        tokens per second. At most `maxsize` keys are tracked; the least
+        recently seen keys are forgotten first.
+    """
+
+    def __init__(self, rate: float, burst: int, maxsize: int = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self._buckets: OrderedDict[Hashable, tuple[float, float]] = OrderedDict()
+        self.rejected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def allow(self, key: Hashable, cost: float = 1.0) -> bool:
+        """ Take `cost` tokens from the key's bucket.
+            Returns False, without taking anything, if there aren't enough.
+        """
+        if not self.enabled:
+            return True
+
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        else:
+            self.rejected += 1
+
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+
+        return allowed
+
+    def retry_after(self, key: Hashable, cost: float = 1.0) -> int:
+        """ Whole seconds until the key's bucket holds `cost` tokens.
+        """
+        tokens, updated = self._buckets.get(key, (self.burst, time.monotonic()))
+        tokens = min(self.burst, tokens + (time.monotonic() - updated) * self.rate)
+        if tokens >= cost or not self.enabled:
+            return 0
+        return math.ceil((cost - tokens) / self.rate)
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import time
+
+from typing import Any, Awaitable, Callable
+
+
+logger = logging.getLogger(__name__)
+
+
+class RevocationList:
+    """ Per-worker copy of the revoked sessions and users, used to accept
+        stateless tokens without a session lookup. New entries are read
+        every `interval` seconds through `load(cursor)`, which returns the
+        entries published since `cursor` and the next cursor.
+
+        Revoked sessions are kept as 64 bit integers taken from their key,
+        which keeps the set compact; a collision only costs the unlucky
+        session a normal lookup. Entries are dropped once they expire.
+    """
+
+    def __init__(
+        self,
+        load: Callable[[Any], Awaitable[tuple[list[dict[str, Any]], Any]]],
+        interval: float,
+        max_age: float,
+        name: str = "revocations",
+    ):
+        self._load = load
+        self.interval = interval
+        self.max_age = max_age
+        self.name = name
+        self._sessions: dict[int, float] = {}
+        self._users: dict[int, tuple[float, float]] = {}
+        self._cursor: Any = None
+        self._task: asyncio.Task | None = None
+        self.refreshed_at: float | None = None
+
+    def __len__(self) -> int:
+        return len(self._sessions) + len(self._users)
+
+    @staticmethod
+    def _fingerprint(session_key: str) -> int:
+        return int(session_key[:16], 16)
+
+    @property
+    def fresh(self) -> bool:
+        """ True if the list was refreshed within `max_age` seconds.
+        """
+        return (
+            self.refreshed_at is not None
+            and time.monotonic() - self.refreshed_at < self.max_age
+        )
+
+    def add(self, entry: dict[str, Any]) -> None:
+        """ Apply a revocation entry. Applying one twice has no effect.
+        """
+        expires_at = entry["expires_at"]
+        if entry["sid"] is not None:
+            self._sessions[self._fingerprint(entry["sid"])] = expires_at
+        if entry["user_id"] is not None:
+            revoked_at = entry["revoked_at"]
+            current = self._users.get(entry["user_id"])
+            if current is None or current[0] < revoked_at:
+                self._users[entry["user_id"]] = (revoked_at, expires_at)
+
+    def is_revoked(self, session_key: str, user_id: int, issued_at: float) -> bool:
+        """ Check a token's session and issue time against the list.
+        """
+        if self._fingerprint(session_key) in self._sessions:
+            return True
+
+        user = self._users.get(user_id)
+        return user is not None and issued_at <= user[0]
+
+    def prune(self) -> int:
+        """ Drop expired entries. Returns the number dropped.
+        """
+        now = time.time()
+        sessions = [k for k, exp in self._sessions.items() if exp <= now]
+        for key in sessions:
+            del self._sessions[key]
+        users = [k for k, (_, exp) in self._users.items() if exp <= now]
+        for key in users:
+            del self._users[key]
+        return len(sessions) + len(users)
+
+    async def refresh(self) -> int:
+        """ Read new entries now. Returns the number read.
+        """
+        entries, self._cursor = await self._load(self._cursor)
+        for entry in entries:
+            self.add(entry)
+        self.prune()
+        self.refreshed_at = time.monotonic()
+        return len(entries)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("%s refresh failed", self.name)
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        """ Start the periodic refresh task on the running event loop.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name=self.name)
+
+    async def stop(self) -> None:
+        """ Stop the periodic refresh task.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -1,13 +1,45 @@
 import functools
 import jwt
+import time
+
+from typing import Any
 
 from sanic import response
 from sanic.request import Request
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from shavon import auth_cache
 from shavon import db
 from shavon import settings
-from shavon.models.auth import User
+from shavon import token_codec
+from shavon.models.auth import AuthUser, User
 from shavon.models.session import Session
+from shavon.stores import build_state_store
+from shavon.utilities import metrics
+from shavon.utilities.middleware import request_session
+from shavon.utilities.revocation import RevocationList
+
+
+# Backend holding sessions and login attempts
+state_store = build_state_store(
+    settings.STATE_STORE,
+    socket_path=settings.STATE_STORE_SOCKET,
+)
+
+
+async def _load_revocations(cursor: Any) -> tuple[list[dict[str, Any]], Any]:
+    async with db.session() as session:
+        return await state_store.revocations_since(session, cursor)
+
+
+# Revoked sessions and users, published by whichever worker revoked them.
+# They expire cached sessions on every worker, and let stateless tokens be
+# accepted without a lookup
+revocation_list = RevocationList(
+    load=_load_revocations,
+    interval=settings.AUTH_REVOCATION_INTERVAL,
+    max_age=settings.AUTH_REVOCATION_MAX_AGE,
+)
 
 
 def auth_required(func):
@@ -23,43 +55,72 @@ def auth_required(func):
             return response.redirect(request.app.url_for('auth.login'))
         
         try:
-            # Decode the JWT payload
-            payload = jwt.decode(
-                auth_cookie,
-                settings.AUTH_COOKIE_SECRET_KEY,
-                algorithms=[settings.AUTH_COOKIE_ALGORITHM],
-            )
+            # Verify the JWT payload; repeat tokens come from the codec's
+            # cache. A stateless token's `exp` only limits how long it is
+            # accepted without a lookup
+            with metrics.timed("jwt"):
+                payload = token_codec.decode(auth_cookie)
             
-            # Extract user_id and session_key from payload
+            # Extract user_id and session token from payload
             user_id = payload.get('user_id')
-            session_key = payload.get('session_key')
+            session_token = payload.get('session_key')
             
-            if not user_id or not session_key:
+            if not user_id or not session_token:
                 raise jwt.InvalidTokenError("Missing user_id or session_key in payload")
+
+            # The cookie's max_age only binds the browser, so a replayed
+            # token is refused once it is older than the cookie would be.
+            # Tokens issued without `iat` rely on the session's expiry
+            issued_at = payload.get('iat')
+            if (
+                issued_at is not None
+                and time.time() - issued_at > settings.AUTH_COOKIE_LIFESPAN
+            ):
+                raise jwt.ExpiredSignatureError("Token outlived its cookie")
+
+            # Sessions are stored under the hash of their token
+            session_key = Session.hash_key(session_token)
             
-            # Verify the session exists and is valid
-            async with db.session() as session:
-                user_session = await Session.get_by_user_and_key(
-                    session=session,
-                    user_id=user_id,
-                    session_key=session_key
-                )
-                
-                if not user_session:
-                    raise jwt.InvalidTokenError("Invalid session")
-                
-                # Get the user data
-                user = await User.get_by_id(session=session, user_id=user_id)
-                if not user or not user.is_active:
-                    raise jwt.InvalidTokenError("User not found or inactive")
-                
-                # Update last_accessed timestamp
-                await user_session.update_last_accessed(session)
-                await session.commit()
-                
-                # Attach user to request for use in the view function
-                request.ctx.user = user
-                request.ctx.session = user_session
+            if settings.AUTH_STATELESS and _accept_stateless(
+                payload,
+                user_id,
+                session_key,
+            ):
+                # Trust the signed claims; nothing is looked up or touched
+                user_session = Session(session_key=session_key, user_id=user_id)
+                user = AuthUser(id=user_id, email=None, is_active=True)
+
+            else:
+                # Reuse a recently validated session if one is cached and
+                # hasn't been revoked since, by another worker included
+                cache_key = (user_id, session_key)
+                cached = _cached_session(cache_key)
+                if cached:
+                    user_session, user = cached
+                else:
+                    validated_at = time.time()
+                    user_session, user = await _load_session(
+                        request,
+                        user_id,
+                        session_key,
+                    )
+                    auth_cache.set(cache_key, (user_session, user, validated_at))
+
+                # Record the access; stores may batch or skip the write
+                await state_store.touch(user_session)
+
+                # Slide the stateless window forward, or upgrade a token
+                # issued without the stateless claims
+                if settings.AUTH_STATELESS and _needs_reissue(payload):
+                    request.ctx.reissue_token = build_auth_token(
+                        user,
+                        session_token,
+                        session_key,
+                    )
+
+            # Attach user to request for use in the view function
+            request.ctx.user = user
+            request.ctx.session = user_session
                 
         except jwt.InvalidTokenError:
             # If session is invalid, destroy the cookie and redirect to login
@@ -75,6 +136,174 @@ def auth_required(func):
     return wrapper
 
 
+def _cached_session(
+    cache_key: tuple[int, str],
+) -> tuple[Session, AuthUser] | None:
+    """
+    Get a cached (Session, AuthUser) pair, unless it was revoked after it was
+    validated. Nothing is trusted from the cache while the revocation list
+    is out of date, as revocations from other workers could be missing.
+    """
+    cached = auth_cache.get(cache_key)
+    if not cached:
+        return None
+
+    user_session, user, validated_at = cached
+    if not revocation_list.fresh or revocation_list.is_revoked(
+        user_session.session_key,
+        user_session.user_id,
+        validated_at,
+    ):
+        auth_cache.invalidate(cache_key)
+        return None
+    return user_session, user
+
+
+def _needs_reissue(payload: dict[str, Any]) -> bool:
+    """
+    Check if a token is missing the stateless claims or is close to `exp`.
+    """
+    exp = payload.get('exp')
+    if exp is None or 'sid' not in payload or 'iat' not in payload:
+        return True
+    return exp - time.time() < settings.AUTH_TOKEN_REFRESH_WINDOW
+
+
+def _accept_stateless(
+    payload: dict[str, Any],
+    user_id: int,
+    session_key: str,
+) -> bool:
+    """
+    Check if a token can be accepted on its claims alone. Anything doubtful
+    (an outdated revocation list, a revoked or expiring token) falls back to
+    a session lookup, which has the final say.
+    """
+    if not revocation_list.fresh or _needs_reissue(payload):
+        return False
+    if payload['sid'] != session_key or not payload.get('active'):
+        return False
+    return not revocation_list.is_revoked(session_key, user_id, payload['iat'])
+
+
+def build_auth_token(
+    user: User | AuthUser,
+    session_token: str,
+    session_key: str,
+) -> str:
+    """
+    Build the signed auth cookie value for a session. With AUTH_STATELESS the
+    token also carries the claims needed to accept it without a lookup.
+    """
+    now = int(time.time())
+    payload = {
+        "user_id": user.id,
+        "session_key": session_token,
+        "iat": now,
+    }
+
+    if settings.AUTH_STATELESS:
+        payload.update({
+            "sid": session_key,
+            "exp": now + settings.AUTH_TOKEN_LIFESPAN,
+            "active": user.is_active,
+        })
+
+    return token_codec.encode(payload)
+
+
+def set_auth_cookie(
+    response: response.HTTPResponse,
+    token: str,
+) -> response.HTTPResponse:
+    """
+    Attach the auth cookie to a response.
+    """
+    response.add_cookie(
+        settings.AUTH_COOKIE_NAME,
+        token,
+        domain=settings.AUTH_COOKIE_DOMAIN,
+        max_age=settings.AUTH_COOKIE_LIFESPAN,
+    )
+    return response
+
+
+async def reissue_auth_cookie(
+    request: Request,
+    response: response.HTTPResponse,
+) -> None:
+    """
+    Response middleware sending the token reissued by auth_required, if any.
+    """
+    token = getattr(request.ctx, 'reissue_token', None)
+    if token:
+        set_auth_cookie(response, token)
+
+
+async def _load_session(
+    request: Request,
+    user_id: int,
+    session_key: str,
+) -> tuple[Session, AuthUser]:
+    """
+    Load and validate a session and its user from the state store.
+    Raises jwt.InvalidTokenError if either is missing or the user is inactive.
+    """
+    session = await request_session(request)
+    loaded = await state_store.load_auth(
+        session=session,
+        user_id=user_id,
+        session_key=session_key
+    )
+
+    if not loaded:
+        raise jwt.InvalidTokenError("Invalid session or inactive user")
+
+    # Detach the session so the cached copy isn't tied to this request
+    user_session, user = loaded
+    if user_session in session:
+        session.expunge(user_session)
+
+    return user_session, user
+
+
+def invalidate_cached_session(user_id: int, session_key: str) -> None:
+    """
+    Drop a session from the auth cache, e.g. when it is logged out.
+    """
+    auth_cache.invalidate((user_id, session_key))
+
+
+def invalidate_cached_user(user_id: int) -> None:
+    """
+    Drop every cached session of a user, e.g. when they are deactivated.
+    """
+    auth_cache.invalidate_where(lambda key: key[0] == user_id)
+
+
+async def revoke_session(session: AsyncSession, user_session: Session) -> None:
+    """
+    Make a session invalid on every worker, e.g. when it is logged out: its
+    cached copies and stateless tokens. This worker stops accepting it
+    straight away, the others within AUTH_REVOCATION_INTERVAL.
+    """
+    invalidate_cached_session(user_session.user_id, user_session.session_key)
+    entry = state_store.revocation_entry(sid=user_session.session_key)
+    await state_store.revoke(session, entry)
+    revocation_list.add(entry)
+
+
+async def revoke_user(session: AsyncSession, user_id: int) -> None:
+    """
+    Make every session of a user validated or token issued so far invalid
+    on every worker, e.g. when they are deactivated.
+    """
+    invalidate_cached_user(user_id)
+    entry = state_store.revocation_entry(user_id=user_id)
+    await state_store.revoke(session, entry)
+    revocation_list.add(entry)
+
+
 def clear_cookie(response: response.HTTPResponse) -> response.HTTPResponse:
     """
     Clear the session cookie by setting its max_age to 0.
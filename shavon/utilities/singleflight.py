@@ -0,0 +1,60 @@
+import asyncio
+
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    """ Lets concurrent callers with the same key share one in-flight call,
+        so a burst of identical lookups costs a single one. Callers that
+        arrive after the call finishes start a new one; nothing is cached.
+        Per-process and meant to be used from the event loop.
+    """
+
+    def __init__(self, name: str = "singleflight"):
+        self.name = name
+        self._calls: dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(
+        self,
+        key: Hashable,
+        func: Callable[[], Awaitable[Any]],
+    ) -> tuple[Any, bool]:
+        """ Await `func()`, or the call already in flight for `key`.
+            Returns the result and whether it came from another caller's
+            call. Exceptions are raised to every waiting caller. If the
+            caller running the call is cancelled, the others run it again.
+        """
+        while (call := self._calls.get(key)) is not None:
+            # Shielded, so a waiter being cancelled doesn't cancel the call
+            try:
+                result = await asyncio.shield(call)
+            except asyncio.CancelledError:
+                if not call.cancelled():
+                    raise
+                continue
+            self.coalesced += 1
+            return result, True
+
+        call = asyncio.get_running_loop().create_future()
+        self._calls[key] = call
+        self.calls += 1
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            call.cancel()
+            raise
+        except BaseException as err:
+            call.set_exception(err)
+            # Waiters may not exist; don't warn about an unretrieved error
+            call.exception()
+            raise
+        else:
+            call.set_result(result)
+            return result, False
+        finally:
+            del self._calls[key]
@@ -1,11 +1,53 @@
+import hashlib
+import os
 import sanic
+import time
+import warnings
 
 from types import ModuleType
 from typing import Any, Callable
 from datetime import datetime
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 
-from shavon.utilities import random_alphanumeric
+from shavon import static_assets
+from shavon.utilities import metrics
+
+
+def nocache(name: Any = None, *args: Any) -> str:
+    """ Deprecated; use asset_url. Given an asset name, returns its
+        fingerprinted URL. The old `?{{ nocache() }}` suffix, which defeated
+        caching with a random string, now renders nothing.
+    """
+    warnings.warn(
+        "the nocache template global is deprecated, use asset_url",
+        DeprecationWarning,
+        stacklevel=2,
+    )
+    if isinstance(name, str):
+        return static_assets.url(name)
+    return ""
+
+
+# Globals exposed to every template
+TEMPLATE_GLOBALS: dict[str, Callable] = {
+    'len': len,
+    'datetime': datetime,
+    'asset_url': static_assets.url,
+    'nocache': nocache,
+    'str': str,
+    'usd': lambda x: "${:,.2f} USD".format(x),
+    'datefmt': lambda x: x.strftime('%Y-%m-%d'),
+}
+
+# Size, in characters, of the chunks sent by `stream_template`
+STREAM_CHUNK_SIZE = 8192
+
+# Process-wide template environments, built once per worker by `init_env`
+_template_env: Environment | None = None
+_template_async_env: Environment | None = None
+
+# (digest, last modified) of the template files, see `templates_version`
+_templates_version: tuple[str, float] | None = None
 
 
 def _build_env(
@@ -17,45 +59,126 @@ def _build_env(
     # Build the template environment
     template_env = Environment(
         loader=FileSystemLoader(
-            template_path, 
+            template_path,
             encoding='utf-8'
-        ), 
+        ),
         **config
     )
 
     # Add globals
     for k, v in globals.items():
         template_env.globals[k] = v
-    
+
     return template_env
 
 
-def render_template(
-    file_name: str,
+def _build_bytecode_cache(
     settings: ModuleType,
-    request: sanic.request = None, 
-    wrapper: str = 'public_wrapper.html',
-    env_config: dict[str, Any] = {},
-    **kwargs: dict[str, Any]
-) -> str:
-    """ Renders a template with given data and returns a string.
+    pattern: str = '__jinja2_%s.cache',
+) -> FileSystemBytecodeCache | None:
+    """ Build the on-disk bytecode cache shared by every worker on the host.
+        Returns None when the bytecode cache is disabled.
     """
+    if not settings.TEMPLATE_BYTECODE_CACHE:
+        return None
+
+    # An empty path lets jinja pick a per-user directory in the temp folder
+    cache_path = settings.TEMPLATE_BYTECODE_CACHE_PATH or None
+    if cache_path:
+        os.makedirs(cache_path, exist_ok=True)
+
+    return FileSystemBytecodeCache(cache_path, pattern=pattern)
+
 
-    env = _build_env(
-        settings.TEMPLATE_PATH, 
-        config=env_config,
-        globals={
-            'len': len,
-            'datetime': datetime,
-            'nocache': random_alphanumeric,
-            'str': str,
-            'usd': lambda x: "${:,.2f} USD".format(x),
-            'datefmt': lambda x: x.strftime('%Y-%m-%d'),
-        }
+def _build_shared_env(
+    settings: ModuleType,
+    enable_async: bool = False,
+) -> Environment:
+    """ Build a cached template environment from settings.
+        Async environments compile to different code, so their bytecode is
+        kept under a separate file pattern.
+    """
+    pattern = '__jinja2_async_%s.cache' if enable_async else '__jinja2_%s.cache'
+    return _build_env(
+        settings.TEMPLATE_PATH,
+        config={
+            'cache_size': settings.TEMPLATE_CACHE_SIZE,
+            'auto_reload': settings.TEMPLATE_AUTO_RELOAD,
+            'bytecode_cache': _build_bytecode_cache(settings, pattern),
+            'enable_async': enable_async,
+        },
+        globals=TEMPLATE_GLOBALS,
     )
-    
-    template = env.get_template(file_name)
 
+
+def init_env(settings: ModuleType, preload: bool = True) -> Environment:
+    """ Build the process-wide template environments.
+        Templates are compiled up front when auto reload is disabled so that
+        the first request served by a worker doesn't pay for compilation.
+    """
+    global _template_env, _template_async_env
+
+    _template_env = _build_shared_env(settings)
+    _template_async_env = _build_shared_env(settings, enable_async=True)
+
+    if preload and not settings.TEMPLATE_AUTO_RELOAD:
+        for env in (_template_env, _template_async_env):
+            for name in env.list_templates(extensions=['html']):
+                env.get_template(name)
+
+    return _template_env
+
+
+def templates_version(settings: ModuleType) -> tuple[str, float]:
+    """ A digest of the template files' names, sizes and modification times,
+        and the latest modification time, for caches of rendered pages to
+        tell deploys apart. Read once per worker unless templates auto
+        reload.
+    """
+    global _templates_version
+
+    if _templates_version is not None and not settings.TEMPLATE_AUTO_RELOAD:
+        return _templates_version
+
+    digest = hashlib.sha256()
+    modified = 0.0
+    for directory, _, files in sorted(os.walk(settings.TEMPLATE_PATH)):
+        for file_name in sorted(files):
+            path = os.path.join(directory, file_name)
+            st = os.stat(path)
+            name = os.path.relpath(path, settings.TEMPLATE_PATH)
+            digest.update(f"{name}:{st.st_size}:{st.st_mtime_ns};".encode())
+            modified = max(modified, st.st_mtime)
+
+    _templates_version = (digest.hexdigest()[:16], modified)
+    return _templates_version
+
+
+def get_env(settings: ModuleType) -> Environment:
+    """ Return the process-wide template environment, building it on first use.
+    """
+    if _template_env is None:
+        init_env(settings, preload=False)
+    return _template_env
+
+
+def get_async_env(settings: ModuleType) -> Environment:
+    """ Return the process-wide async template environment, building it on
+        first use.
+    """
+    if _template_async_env is None:
+        init_env(settings, preload=False)
+    return _template_async_env
+
+
+def _build_context(
+    settings: ModuleType,
+    request: sanic.request = None,
+    wrapper: str = 'public_wrapper.html',
+    **kwargs: dict[str, Any]
+) -> dict[str, Any]:
+    """ Build the context shared by every template render.
+    """
     context = dict(
         wrapper=wrapper,
         **settings.SAFE_SETTINGS,
@@ -66,5 +189,101 @@ def render_template(
         if hasattr(request.ctx, 'notices'):
             context['notices'] = request.ctx.notices
 
-    return template.render(context, **kwargs)
+    context.update(kwargs)
+    return context
+
+
+def render_template(
+    file_name: str,
+    settings: ModuleType,
+    request: sanic.request = None,
+    wrapper: str = 'public_wrapper.html',
+    env_config: dict[str, Any] = {},
+    **kwargs: dict[str, Any]
+) -> str:
+    """ Renders a template with given data and returns a string.
+        Passing `env_config` renders through a one-off overlay of the shared
+        environment, so templates compiled for it are not kept.
+    """
+
+    env = get_env(settings)
+    if env_config:
+        env = env.overlay(**env_config)
+
+    with metrics.timed("render"):
+        template = env.get_template(file_name)
+        context = _build_context(settings, request, wrapper, **kwargs)
+        return template.render(context)
+
+
+async def render_template_async(
+    file_name: str,
+    settings: ModuleType,
+    request: sanic.request = None,
+    wrapper: str = 'public_wrapper.html',
+    **kwargs: dict[str, Any]
+) -> str:
+    """ Renders a template with given data without blocking the event loop
+        and returns a string.
+    """
+    with metrics.timed("render"):
+        template = get_async_env(settings).get_template(file_name)
+        context = _build_context(settings, request, wrapper, **kwargs)
+        return await template.render_async(context)
+
+
+async def stream_template(
+    file_name: str,
+    settings: ModuleType,
+    request: sanic.request,
+    wrapper: str = 'public_wrapper.html',
+    status: int = 200,
+    headers: dict[str, str] | None = None,
+    **kwargs: dict[str, Any]
+) -> sanic.HTTPResponse | None:
+    """ Renders a template and streams it to the client in chunks.
+        The response is sent directly, so views should return the result of
+        this call (None) instead of building their own response:
+
+            return await stream_template("info/index.html", settings, request)
+
+        When `request.ctx.buffer_response` is set, e.g. by `cached_page`, the
+        whole page is rendered and returned as a response instead.
+    """
+    started = time.perf_counter()
+    template = get_async_env(settings).get_template(file_name)
+    context = _build_context(settings, request, wrapper, **kwargs)
+    rendering = time.perf_counter() - started
+
+    if getattr(request.ctx, 'buffer_response', False):
+        started = time.perf_counter()
+        body = await template.render_async(context)
+        metrics.record_stage("render", rendering + time.perf_counter() - started)
+        return sanic.html(body, status=status, headers=headers)
+
+    response = await request.respond(
+        status=status,
+        headers=headers,
+        content_type='text/html; charset=utf-8',
+    )
+
+    # Coalesce the small pieces jinja yields into reasonably sized chunks.
+    # Time spent sending isn't counted as rendering
+    buffer = []
+    buffered = 0
+    started = time.perf_counter()
+    async for piece in template.generate_async(context):
+        buffer.append(piece)
+        buffered += len(piece)
+        if buffered >= STREAM_CHUNK_SIZE:
+            rendering += time.perf_counter() - started
+            await response.send(''.join(buffer))
+            started = time.perf_counter()
+            buffer.clear()
+            buffered = 0
+
+    rendering += time.perf_counter() - started
+    metrics.record_stage("render", rendering)
 
+    if buffer:
+        await response.send(''.join(buffer))
@@ -0,0 +1,110 @@
+""" Signing and verification of auth tokens.
+
+Several keys can be active at once so that the signing key can be rotated
+without logging everyone out. Keys are configured as `kid=secret,...`; the
+first one signs new tokens and names itself in the `kid` header, the others
+only verify. Tokens without a `kid` are verified with the default key.
+"""
+import hashlib
+import time
+
+from typing import Any
+
+import jwt
+
+from shavon.utilities.cache import TTLCache
+
+
+def parse_keys(keys: str) -> dict[str, str]:
+    """ Parse a `kid=secret,...` string into an ordered mapping.
+    """
+    parsed = {}
+    for item in filter(None, keys.split(",")):
+        kid, sep, secret = item.partition("=")
+        if not sep or not kid.strip() or not secret:
+            raise ValueError("Token keys must be given as kid=secret")
+        parsed[kid.strip()] = secret
+    return parsed
+
+
+class TokenCodec:
+    """ Encodes and decodes signed tokens with prepared keys and a fixed
+        algorithm. Verified payloads are cached by the token's digest, so a
+        token seen again within the cache's ttl isn't parsed or verified.
+        Cached payloads are shared and must not be modified.
+    """
+
+    def __init__(
+        self,
+        algorithm: str,
+        default_key: str | None = None,
+        keys: dict[str, str] | None = None,
+        cache: TTLCache | None = None,
+        options: dict[str, Any] | None = None,
+    ):
+        self.algorithm = algorithm
+        self.cache = cache
+        self._jwt = jwt.PyJWT(options=options)
+        self._algorithms = [algorithm]
+
+        # Keys are prepared once instead of on every encode and decode
+        prepare = jwt.get_algorithm_by_name(algorithm).prepare_key
+        self._keys = {kid: prepare(secret) for kid, secret in (keys or {}).items()}
+        self._default_key = prepare(default_key) if default_key else None
+        self._signing_kid = next(iter(self._keys), None)
+
+    def encode(self, payload: dict[str, Any]) -> str:
+        """ Sign a payload with the current signing key.
+        """
+        if self._signing_kid is not None:
+            return self._jwt.encode(
+                payload,
+                self._keys[self._signing_kid],
+                algorithm=self.algorithm,
+                headers={"kid": self._signing_kid},
+            )
+        return self._jwt.encode(
+            payload,
+            self._default_key,
+            algorithm=self.algorithm,
+        )
+
+    def _key_for(self, token: str) -> Any:
+        kid = jwt.get_unverified_header(token).get("kid")
+        if kid is None:
+            key = self._default_key
+        else:
+            key = self._keys.get(kid)
+        if key is None:
+            raise jwt.InvalidTokenError(f"Unknown signing key: {kid}")
+        return key
+
+    def decode(self, token: str) -> dict[str, Any]:
+        """ Verify a token and return its payload.
+            Raises jwt.InvalidTokenError if it can't be verified.
+        """
+        if self.cache is None:
+            return self._jwt.decode(
+                token,
+                self._key_for(token),
+                algorithms=self._algorithms,
+            )
+
+        digest = hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest()
+        payload = self.cache.get(digest)
+        if payload is not None:
+            return payload
+
+        payload = self._jwt.decode(
+            token,
+            self._key_for(token),
+            algorithms=self._algorithms,
+        )
+
+        # Don't keep a payload past its own expiry
+        ttl = self.cache.ttl
+        if "exp" in payload:
+            ttl = min(ttl, payload["exp"] - time.time())
+        if ttl > 0:
+            self.cache.set(digest, payload, ttl=ttl)
+        return payload
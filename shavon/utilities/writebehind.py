@@ -0,0 +1,82 @@
+import asyncio
+import logging
+
+from typing import Any, Awaitable, Callable, Hashable
+
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """ Collects writes in memory and hands them to `flush` in one batch
+        every `interval` seconds. Repeated writes to the same key between
+        flushes are coalesced, so only the latest value is written.
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[dict[Hashable, Any]], Awaitable[None]],
+        interval: float,
+        name: str = "write-behind",
+    ):
+        self._flush = flush
+        self.interval = interval
+        self.name = name
+        self._pending: dict[Hashable, Any] = {}
+        self._task: asyncio.Task | None = None
+        self.flushed = 0
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """ Queue a write, replacing any pending write for the same key.
+        """
+        self._pending[key] = value
+
+    async def flush(self) -> int:
+        """ Write every pending item now. Returns the number written.
+            Items are queued again if the write fails or is cancelled,
+            unless a newer write for the same key has arrived in the
+            meantime.
+        """
+        if not self._pending:
+            return 0
+
+        items, self._pending = self._pending, {}
+        try:
+            await self._flush(items)
+        except BaseException:
+            for key, value in items.items():
+                self._pending.setdefault(key, value)
+            raise
+
+        self.flushed += len(items)
+        return len(items)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("%s flush failed", self.name)
+
+    def start(self) -> None:
+        """ Start the periodic flush task on the running event loop.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name=self.name)
+
+    async def stop(self) -> None:
+        """ Stop the periodic flush task and write anything still pending.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        await self.flush()
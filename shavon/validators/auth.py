@@ -1,6 +1,11 @@
+import logging
+
 from pydantic import BaseModel, field_validator
 
 
+logger = logging.getLogger(__name__)
+
+
 class LoginForm(BaseModel):
     """ Form for user login.
     """
@@ -13,7 +18,7 @@ class LoginForm(BaseModel):
     @classmethod
     def validate_captcha(cls, captcha: str, values: dict) -> str:
         if values.data.get('require_captcha', False):
-            print("Captcha is required.")
+            logger.debug("Captcha is required")
             if captcha is None or len(captcha.strip()) <= 0:
                 raise ValueError("Required")
         return captcha